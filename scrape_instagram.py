@@ -12,7 +12,7 @@ import re
 import time
 import argparse
 import urllib.parse
-from datetime import datetime
+from datetime import datetime, timezone
 from selenium import webdriver
 from selenium.webdriver.firefox.options import Options
 from selenium.webdriver.firefox.service import Service
@@ -21,11 +21,28 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.action_chains import ActionChains
-from selenium.common.exceptions import TimeoutException
+from selenium.common.exceptions import WebDriverException, InvalidSessionIdException, NoSuchWindowException
 from tqdm import tqdm
 import json
 import requests
 import glob
+import sqlite3
+import shutil
+import tempfile
+import array
+import bisect
+import heapq
+import mmap
+import struct
+import csv
+import subprocess
+import threading
+import socket
+import queue
+import itertools
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
 
 # === Command Line Arguments ===
 parser = argparse.ArgumentParser(description="Scrape Instagram post and reel media URLs")
@@ -36,7 +53,7 @@ parser.add_argument("--max-grabbed-posts", type=int, help="Max posts to download
 parser.add_argument("--resume-log", help="Log file for storing scanned post URLs (now stores scraped order)")
 parser.add_argument("--resume-file", help="File to track last successfully downloaded post URL")
 parser.add_argument("--no-resume", dest="no_resume", action="store_true", help="Ignore resume file and start fresh")
-parser.add_argument("--processed-urls-file", help="File to track all unique URLs already processed")
+parser.add_argument("--processed-urls-file", help="File to track all unique URLs already processed (stored as a compact <name>.idx media ID index; a legacy JSON list at this path is migrated)")
 parser.add_argument("--headless", action="store_true", help="Run browser in headless mode")
 parser.add_argument("--login", action="store_true", help="Open browser for Instagram login and save session to Firefox profile")
 parser.add_argument("--download-path", help="Directory to save downloaded media (default: ./downloads)")
@@ -47,24 +64,68 @@ parser.add_argument("--retry-errors-only", action="store_true", help="Only retry
 parser.add_argument("--cleanup-and-retry", action="store_true", help="Delete post directories with no images or videos, remove their URLs from processed log, and retry them.")
 parser.add_argument("--download-stories", action="store_true", help="Download all available stories for the target user (requires login)")
 parser.add_argument("--skip-posts", action="store_true", help="Only download stories, skip posts and reels (equivalent to --max-scraped-posts 0)")
+parser.add_argument("--verify", action="store_true", help="Check downloaded images and videos for truncation/corruption, queue corrupt posts in the error log and retry them")
+parser.add_argument("--verify-workers", type=int, default=os.cpu_count() or 4, help="Worker threads used by --verify and --catalog-rebuild (default: CPU count)")
+parser.add_argument("--no-catalog", action="store_true", help="Do not record posts and stories in the download root's catalog.sqlite")
+parser.add_argument("--catalog-query", action="store_true", help="Print catalog entries (filter with --username, --since, --until) and exit; no browser is started")
+parser.add_argument("--catalog-kind", choices=["posts", "stories"], default="posts", help="Which catalog table --catalog-query reads (default: posts)")
+parser.add_argument("--catalog-format", choices=["json", "csv"], default="json", help="Output format for --catalog-query (default: json)")
+parser.add_argument("--catalog-export", help="Write --catalog-query results to this file instead of stdout")
+parser.add_argument("--since", help="Catalog filter: only entries with timestamp >= this ISO date/time prefix (e.g. 2024-03-01)")
+parser.add_argument("--until", help="Catalog filter: only entries with timestamp up to and including this ISO date/time prefix (e.g. 2024-03-31)")
+parser.add_argument("--catalog-rebuild", action="store_true", help="Rebuild catalog.sqlite from the existing post and story directories and exit; no browser is started")
+parser.add_argument("--video-workers", type=int, default=1, help="Number of yt-dlp video downloads to run in parallel (as separate processes) while scraping continues (default: 1, download inline)")
+parser.add_argument("--concurrent-fragments", type=int, default=4, help="Number of DASH/HLS fragments yt-dlp downloads concurrently within each video (default: 4)")
+parser.add_argument("--coordinator-db", help="Shared SQLite file (e.g. on the /data volume) used to lease posts to several workers scraping the same profile")
+parser.add_argument("--worker-id", help="Stable name of this worker in --coordinator-db (required with it); its error logs are tagged with it and retried by the next run with the same ID")
+parser.add_argument("--lease-ttl", type=int, default=600, help="Seconds a post lease lives without a heartbeat before another worker may reclaim it (default: 600)")
+parser.add_argument("--recycle-after-pages", type=int, default=300, help="Restart Firefox after this many post pages to reclaim leaked memory (0 to disable, default: 300)")
+parser.add_argument("--max-browser-rss", type=int, default=3072, help="Restart Firefox when its processes use more than this many MB of RSS (0 to disable, default: 3072)")
+parser.add_argument("--extract-cache-ttl", type=int, default=6 * 3600, help="Seconds an extracted post (metadata + media URLs) stays reusable by retries and re-runs without reloading the page; entries also expire with their CDN URLs (0 to disable, default: 21600)")
+parser.add_argument("--extract-cache-max-mb", type=int, default=64, help="Size limit of the extraction cache in MB; least recently used entries are evicted (default: 64)")
+parser.add_argument("--global-index", action="store_true", help="Share one shortcode index across all accounts in the download path: posts already downloaded for another account (collabs, reposts) are linked instead of downloaded again")
+parser.add_argument("--max-runtime", type=int, help="Time budget for the run in seconds: posts whose estimated processing time no longer fits are deferred to the next run")
+parser.add_argument("--priority", choices=["oldest", "newest", "video-last", "smallest-first"], default="oldest", help="Order in which pending posts are processed: 'oldest' first (default), 'newest' first, newest first with reels last ('video-last'), or cheapest estimated first ('smallest-first')")
+parser.add_argument("--serve", action="store_true", help="Run as a job server: keep warm browser workers and accept post/profile/stories/retry jobs over a local HTTP endpoint")
+parser.add_argument("--serve-host", default="127.0.0.1", help="Address the --serve endpoint binds to (default: 127.0.0.1)")
+parser.add_argument("--serve-port", type=int, default=8765, help="Port of the --serve endpoint (default: 8765)")
+parser.add_argument("--serve-browsers", type=int, default=1, help="Number of warm browser workers, i.e. jobs run concurrently by --serve (default: 1)")
+parser.add_argument("--serve-max-queue", type=int, default=100, help="Maximum number of queued --serve jobs before new ones are rejected (default: 100)")
+parser.add_argument("--serve-worker", action="store_true", help=argparse.SUPPRESS)  # internal: one warm browser driven by --serve
+parser.add_argument("--tabs", type=int, default=1, help="Number of browser tabs used to pipeline post page loads within one Firefox: upcoming posts load in background tabs while the current one is extracted (default: 1)")
+parser.add_argument("--extraction-backend", choices=["selenium", "http"], default="selenium", help="How post data is extracted: 'selenium' (live browser page) or 'http' (plain HTTP requests with the profile's cookies, falling back to selenium per post on failure)")
+parser.add_argument("--media-quality", default="max", help="Media quality policy: 'max' (largest rendition), 'min' (smallest rendition) or a width cap in pixels such as '1080' (default: max)")
 args = parser.parse_args()
 
 # === Constants ===
 BASE_URL = "https://www.instagram.com"
-PROFILE_URL = f"{BASE_URL}/{args.username}/"
-POST_URL = f"{BASE_URL}/p/{args.post_id}/" if args.post_id else None
-SESSION_NAME = args.post_id if args.post_id else args.username
 DOWNLOAD_ROOT = os.path.abspath(args.download_path) if args.download_path else os.path.abspath("downloads")
 PROFILE_DIR = os.path.abspath(args.firefox_profile_dir) if args.firefox_profile_dir else os.path.abspath("./firefox_profile")
-MAX_GRABBED_POSTS = args.max_grabbed_posts if args.max_grabbed_posts else None
 os.makedirs(DOWNLOAD_ROOT, exist_ok=True)
-timestamp_now = datetime.now().strftime("%Y%m%d_%H%M%S")
+# Catalog commands only read/write the download root and never need a browser
+OFFLINE_MODE = args.catalog_query or args.catalog_rebuild
+# The --serve front end only dispatches jobs; its --serve-worker processes own the browsers
+SERVER_MODE = args.serve or args.serve_worker
+
+# A --serve-worker answers its server on the original stdout. Everything else written to fd 1,
+# including by geckodriver and yt-dlp child processes, is sent to stderr instead.
+if args.serve_worker:
+    serve_results = os.fdopen(os.dup(sys.stdout.fileno()), "w", buffering=1)
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
 
 # === Argument Validations ===
 # Require --username unless --login is used
-if not args.login and not args.username:
+if not args.login and not args.username and not OFFLINE_MODE and not SERVER_MODE:
     parser.error("--username is required unless using --login")
 
+# Media quality policy: "max", "min" or an integer width cap in pixels
+if args.media_quality in ("max", "min"):
+    MEDIA_QUALITY = args.media_quality
+elif args.media_quality.isdigit() and int(args.media_quality) > 0:
+    MEDIA_QUALITY = int(args.media_quality)
+else:
+    parser.error("--media-quality must be 'max', 'min' or a positive pixel width (e.g. 1080)")
+
 # === Mutually exclusive check for --login and --headless ===
 if args.login and args.headless:
     print("[!] Error: --login and --headless cannot be used together.")
@@ -72,7 +133,7 @@ if args.login and args.headless:
     sys.exit(1)
 
 # Warn if PROFILE_DIR does not exist and not in login mode
-if not os.path.exists(PROFILE_DIR):
+if not os.path.exists(PROFILE_DIR) and not OFFLINE_MODE:
     if args.login:
         print(f"[!] Firefox profile directory '{PROFILE_DIR}' does not exist.")
         print(f"[!] --login specified, creating new profile.")
@@ -83,35 +144,65 @@ if not os.path.exists(PROFILE_DIR):
         print("    Run this script with the --login flag to do so.")
         sys.exit(1)
 
-# Paths for persistence files if not in login mode
-if not args.login:
-    RESUME_FILE = args.resume_file or os.path.join(DOWNLOAD_ROOT, SESSION_NAME, "last-post-url.txt")
-    RESUME_LOG = args.resume_log or os.path.join(DOWNLOAD_ROOT, SESSION_NAME, f"{SESSION_NAME}-posts_{timestamp_now}.log")
-    ERROR_LOG = RESUME_LOG.replace("posts_", "errors_")
-    PROCESSED_URLS_FILE = os.path.join(DOWNLOAD_ROOT, SESSION_NAME, "processed-urls.json")
-    if args.processed_urls_file:
-        PROCESSED_URLS_FILE = os.path.abspath(args.processed_urls_file)
-    session_dir = os.path.join(DOWNLOAD_ROOT, SESSION_NAME)
-    os.makedirs(session_dir, exist_ok=True)
+# When several workers share a download root, every per-run file name carries the worker ID.
+# It must survive restarts (a hostname or PID would not), or the next run could not find its error logs.
+if args.coordinator_db and not args.worker_id:
+    parser.error("--coordinator-db requires a stable --worker-id (e.g. worker-1)")
+WORKER_ID = args.worker_id or f"{socket.gethostname()}-{os.getpid()}"
+WORKER_TAG = "_" + re.sub(r'[^\w.-]', '_', WORKER_ID) if args.coordinator_db else ""
+
+def configure_session():
+    """
+    (Re)derives the per-session globals from args.username / args.post_id.
+    Called once at startup, and again for every job handled by a --serve-worker.
+    """
+    global PROFILE_URL, POST_URL, SESSION_NAME, MAX_GRABBED_POSTS, timestamp_now
+    global RESUME_FILE, RESUME_LOG, ERROR_LOG, PROCESSED_URLS_FILE
+    PROFILE_URL = f"{BASE_URL}/{args.username}/"
+    POST_URL = f"{BASE_URL}/p/{args.post_id}/" if args.post_id else None
+    SESSION_NAME = args.post_id if args.post_id else args.username
+    MAX_GRABBED_POSTS = args.max_grabbed_posts if args.max_grabbed_posts else None
+    timestamp_now = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+    # Paths for persistence files if not in login mode
+    if not args.login and SESSION_NAME:
+        RESUME_FILE = args.resume_file or os.path.join(DOWNLOAD_ROOT, SESSION_NAME, "last-post-url.txt")
+        RESUME_LOG = args.resume_log or os.path.join(DOWNLOAD_ROOT, SESSION_NAME, f"{SESSION_NAME}-posts_{timestamp_now}{WORKER_TAG}.log")
+        ERROR_LOG = RESUME_LOG.replace("posts_", "errors_")
+        PROCESSED_URLS_FILE = os.path.join(DOWNLOAD_ROOT, SESSION_NAME, "processed-urls.json")
+        if args.processed_urls_file:
+            PROCESSED_URLS_FILE = os.path.abspath(args.processed_urls_file)
+        session_dir = os.path.join(DOWNLOAD_ROOT, SESSION_NAME)
+        os.makedirs(session_dir, exist_ok=True)
+
+configure_session()
 
 # === Selenium Setup ===
-options = Options()
-if args.headless:
-    options.add_argument("--headless")
-options.add_argument("--width=1920")
-options.add_argument("--height=1080")
-if args.login:
-    # Use -profile argument to ensure persistence for manual login
-    options.add_argument("-profile")
-    options.add_argument(PROFILE_DIR)
-    # Do NOT use FirefoxProfile here
-else:
-    # Use FirefoxProfile for normal runs (optional, or just omit for default)
-    profile = FirefoxProfile(PROFILE_DIR)
-    options.profile = profile
-service = Service()
-driver = webdriver.Firefox(service=service, options=options)
-driver.implicitly_wait(10)
+def build_firefox_options():
+    """Builds fresh Firefox options (and a fresh profile copy) for each browser launch."""
+    options = Options()
+    if args.headless:
+        options.add_argument("--headless")
+    options.add_argument("--width=1920")
+    options.add_argument("--height=1080")
+    if args.login:
+        # Use -profile argument to ensure persistence for manual login
+        options.add_argument("-profile")
+        options.add_argument(PROFILE_DIR)
+        # Do NOT use FirefoxProfile here
+    else:
+        # Use FirefoxProfile for normal runs (optional, or just omit for default)
+        profile = FirefoxProfile(PROFILE_DIR)
+        options.profile = profile
+    return options
+
+def launch_driver():
+    """Starts a new Firefox WebDriver session."""
+    new_driver = webdriver.Firefox(service=Service(), options=build_firefox_options())
+    new_driver.implicitly_wait(10)
+    return new_driver
+
+driver = None if OFFLINE_MODE or args.serve else launch_driver()
 # Handle --login mode using Firefox profile and selenium
 if args.login:
     print("[*] Opening Instagram login page in Firefox...")
@@ -127,24 +218,351 @@ def sanitize_filename(url):
     name = urllib.parse.unquote(url.split("?")[0].split("/")[-1])
     return re.sub(r'[^\w.-]', '_', name)
 
+# === Media quality policy ===
+# Running byte counters for the current run, reported by report_media_stats().
+MEDIA_STATS = {
+    "images": 0,
+    "image_bytes": 0,
+    "videos": 0,
+    "video_bytes": 0,
+    "compared_images": 0,  # images whose chosen rendition differs from the default <img src>
+    "compared_videos": 0,  # videos whose format sizes yt-dlp reported
+    "compared_bytes": 0,   # bytes of the renditions we chose for those images/videos
+    "baseline_bytes": 0,   # estimated bytes of the default renditions for the same images/videos
+}
+# Maps a chosen srcset URL to (chosen width, default <img src> width), both in pixels
+MEDIA_RENDITION_WIDTHS = {}
+
+def parse_srcset(srcset):
+    """Parses an <img> srcset attribute into a list of (url, width) tuples (width descriptors only)."""
+    candidates = []
+    if not srcset:
+        return candidates
+    for match in re.finditer(r'\s*([^\s,][^\s]*)\s+(\d+)w\s*(?:,|$)', srcset):
+        candidates.append((match.group(1), int(match.group(2))))
+    return candidates
+
+def select_media_rendition(candidates, policy=None):
+    """
+    Picks one (url, width) candidate according to the media quality policy.
+    'max' takes the widest, 'min' the narrowest, and an integer cap takes the
+    widest candidate not exceeding the cap (or the narrowest if all exceed it).
+    Returns None if there are no candidates.
+    """
+    if not candidates:
+        return None
+    policy = MEDIA_QUALITY if policy is None else policy
+    if policy == "max":
+        return max(candidates, key=lambda c: c[1])
+    if policy == "min":
+        return min(candidates, key=lambda c: c[1])
+    within_cap = [c for c in candidates if c[1] <= policy]
+    if within_cap:
+        return max(within_cap, key=lambda c: c[1])
+    return min(candidates, key=lambda c: c[1])
+
+def pick_image_url(src, srcset, rendered_width=None):
+    """
+    Returns the image URL to download for an <img>, honouring the media quality policy.
+    The default rendition's width is taken from its own srcset entry, falling back
+    to the element's rendered width, so the stats need no extra request.
+    """
+    candidates = parse_srcset(srcset)
+    choice = select_media_rendition(candidates)
+    if not choice:
+        return src
+    url, width = choice
+    if src and url != src:
+        default_width = next((w for candidate_url, w in candidates if candidate_url == src), None) or rendered_width
+        if default_width:
+            MEDIA_RENDITION_WIDTHS[url] = (width, int(default_width))
+    return url
+
+def ytdlp_format_for_quality(policy=None):
+    """Maps the media quality policy to a yt-dlp format selector."""
+    policy = MEDIA_QUALITY if policy is None else policy
+    if policy == "max":
+        return "bestvideo+bestaudio/best"
+    if policy == "min":
+        return "worstvideo+bestaudio/worst"
+    return f"bestvideo[width<={policy}]+bestaudio/best[width<={policy}]/worstvideo+bestaudio/worst"
+
+def format_bytes(num_bytes):
+    """Formats a byte count as a short human readable string."""
+    sign = "-" if num_bytes < 0 else ""
+    num_bytes = abs(num_bytes)
+    if num_bytes < 1024:
+        return f"{sign}{num_bytes} B"
+    for unit in ("KB", "MB", "GB"):
+        num_bytes /= 1024
+        if num_bytes < 1024 or unit == "GB":
+            return f"{sign}{num_bytes:.1f} {unit}"
+
+def fetch_to_file(url, filepath):
+    """Streams a URL to disk and returns the number of bytes written."""
+    written = 0
+    with requests.get(url, stream=True, timeout=20) as r:
+        r.raise_for_status()
+        with open(filepath, 'wb') as f:
+            for chunk in r.iter_content(chunk_size=8192):
+                f.write(chunk)
+                written += len(chunk)
+    return written
+
+def record_image_bytes(url, num_bytes):
+    """
+    Adds a downloaded image to the run stats. If the chosen rendition differs from the
+    default <img src>, the default's size is estimated from the pixel area ratio
+    (same aspect ratio, so (default width / chosen width)^2) instead of fetching it.
+    """
+    MEDIA_STATS["images"] += 1
+    MEDIA_STATS["image_bytes"] += num_bytes
+    widths = MEDIA_RENDITION_WIDTHS.pop(url, None)
+    if widths and widths[0]:
+        MEDIA_STATS["compared_images"] += 1
+        MEDIA_STATS["compared_bytes"] += num_bytes
+        MEDIA_STATS["baseline_bytes"] += round(num_bytes * (widths[1] / widths[0]) ** 2)
+
+def ytdlp_formats_size(formats):
+    """Total reported (or approximate) size of yt-dlp format dicts, or None if any size is unknown."""
+    sizes = [f.get("filesize") or f.get("filesize_approx") for f in formats]
+    return sum(sizes) if sizes and all(sizes) else None
+
+def record_video_formats(info):
+    """
+    Compares the formats yt-dlp picked under --media-quality with what the default
+    'bestvideo+bestaudio/best' selector would have fetched, using yt-dlp's own size figures.
+    info is an extraction result: a single video or a playlist with 'entries'.
+    """
+    for entry in (info.get("entries") or [info]) if info else []:
+        if not entry:
+            continue
+        formats = entry.get("formats") or []
+        # yt-dlp lists formats from worst to best
+        video_only = [f for f in formats if f.get("vcodec") not in (None, "none") and f.get("acodec") == "none"]
+        audio_only = [f for f in formats if f.get("acodec") not in (None, "none") and f.get("vcodec") == "none"]
+        default = [video_only[-1], audio_only[-1]] if video_only and audio_only else formats[-1:]
+        chosen_size = ytdlp_formats_size(entry.get("requested_formats") or [entry])
+        default_size = ytdlp_formats_size(default)
+        if chosen_size and default_size:
+            MEDIA_STATS["compared_videos"] += 1
+            MEDIA_STATS["compared_bytes"] += chosen_size
+            MEDIA_STATS["baseline_bytes"] += default_size
+
+def video_files_size(post_dir):
+    """Total size of the video files in a post directory."""
+    total = 0
+    for f in os.listdir(post_dir):
+        if f.endswith(('.mp4', '.webm', '.mkv')):
+            total += os.path.getsize(os.path.join(post_dir, f))
+    return total
+
+def report_media_stats():
+    """Prints the bytes transferred this run and the difference the quality policy made for images."""
+    if not MEDIA_STATS["images"] and not MEDIA_STATS["videos"]:
+        return
+    print(f"[i] Media quality policy: {MEDIA_QUALITY}")
+    print(f"[i] Downloaded {MEDIA_STATS['images']} images ({format_bytes(MEDIA_STATS['image_bytes'])}) "
+          f"and {MEDIA_STATS['videos']} video posts ({format_bytes(MEDIA_STATS['video_bytes'])})")
+    if MEDIA_STATS["compared_images"] or MEDIA_STATS["compared_videos"]:
+        delta = MEDIA_STATS["compared_bytes"] - MEDIA_STATS["baseline_bytes"]
+        verb = "gained" if delta >= 0 else "saved"
+        print(f"[i] Bytes {verb} vs default renditions: ~{format_bytes(abs(delta))} "
+              f"({MEDIA_STATS['compared_images']} images estimated from rendition widths, "
+              f"{MEDIA_STATS['compared_videos']} videos from yt-dlp format sizes)")
+
+# === Processed post index ===
+# Instagram shortcodes are the media ID encoded with a URL-safe base64 alphabet.
+SHORTCODE_ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_"
+
+def shortcode_to_media_id(shortcode):
+    """
+    Decodes an Instagram shortcode into its numeric media ID.
+    Only the first 11 characters encode the ID; longer shortcodes (private
+    share links) append extra characters, which are ignored.
+    """
+    media_id = 0
+    for char in shortcode[:11]:
+        media_id = media_id * 64 + SHORTCODE_ALPHABET.index(char)
+    return media_id
+
+def post_key_to_media_id(key):
+    """Returns the media ID for a post URL, shortcode or media ID, or None if it cannot be decoded."""
+    if isinstance(key, int):
+        return key
+    shortcode = key.rstrip('/').split('/')[-1]
+    try:
+        media_id = shortcode_to_media_id(shortcode)
+    except ValueError:
+        return None
+    return media_id if shortcode and media_id < 2 ** 64 else None
+
+class ProcessedIndex:
+    """
+    Set-like record of processed posts, keyed by numeric media ID.
+
+    <name>.idx is a sorted array of native-endian uint64 IDs that is memory-mapped
+    read-only, so startup parses nothing and membership is a binary search.
+    <name>.idx.log is an append-only journal of IDs added since the last
+    compaction; it is folded into the sorted array once it grows large or when
+    an ID has to be removed. Accepts post URLs, shortcodes or media IDs.
+    """
+    COMPACT_THRESHOLD = 4096  # journal entries before the sorted array is rewritten
+    # Set to False when other processes share the index; one of them then calls compact() explicitly
+    auto_compact = True
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.journal_path = index_path + ".log"
+        self._file = None
+        self._mmap = None
+        self._ids = memoryview(b"").cast("Q")
+        self._journal = set()   # IDs in the journal file or pending
+        self._pending = []      # IDs not yet appended to the journal
+        self._removed = set()   # IDs to drop from the sorted array on the next compaction
+        self._open_index()
+        # A journal set aside by an interrupted compaction still holds IDs
+        self._journal.update(self._read_journal(self.journal_path + ".compacting"))
+        self._journal.update(self._read_journal(self.journal_path))
+
+    @staticmethod
+    def _read_journal(path):
+        journal = array.array("Q")
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                data = f.read()
+            journal.frombytes(data[:len(data) - len(data) % journal.itemsize])
+        return journal
+
+    def _open_index(self):
+        if not os.path.exists(self.index_path) or os.path.getsize(self.index_path) < 8:
+            return
+        self._file = open(self.index_path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        usable = len(self._mmap) - len(self._mmap) % 8
+        self._ids = memoryview(self._mmap)[:usable].cast("Q")
+
+    def close(self):
+        """Releases the memory map (required before the index file can be replaced on Windows)."""
+        self._ids.release()
+        self._ids = memoryview(b"").cast("Q")
+        if self._mmap is not None:
+            self._mmap.close()
+            self._file.close()
+            self._mmap = None
+            self._file = None
+
+    def _in_sorted(self, media_id):
+        pos = bisect.bisect_left(self._ids, media_id)
+        return pos < len(self._ids) and self._ids[pos] == media_id
+
+    def __contains__(self, key):
+        media_id = post_key_to_media_id(key)
+        if media_id is None:
+            return False
+        if media_id in self._journal:
+            return True
+        return media_id not in self._removed and self._in_sorted(media_id)
+
+    def __len__(self):
+        return len(self._ids) - len(self._removed) + len(self._journal)
+
+    def add(self, key):
+        media_id = post_key_to_media_id(key)
+        if media_id is None:
+            tqdm.write(f"[!] Warning: cannot derive a media ID from {key}, not recording it as processed.")
+            return
+        self._removed.discard(media_id)
+        if media_id not in self._journal and not self._in_sorted(media_id):
+            self._journal.add(media_id)
+            self._pending.append(media_id)
+
+    def discard(self, key):
+        media_id = post_key_to_media_id(key)
+        if media_id is None:
+            return
+        # An ID already written to the journal file would be read back on the next load,
+        # so it has to be dropped by a compaction just like one in the sorted array
+        journaled = media_id in self._journal and media_id not in self._pending
+        self._journal.discard(media_id)
+        if media_id in self._pending:
+            self._pending.remove(media_id)
+        if journaled or self._in_sorted(media_id):
+            self._removed.add(media_id)
+
+    remove = discard
+
+    def flush(self):
+        """Persists pending additions to the journal, compacting when the journal is large or IDs were removed."""
+        if self._removed or (self.auto_compact and len(self._journal) >= self.COMPACT_THRESHOLD):
+            self.compact()
+        elif self._pending:
+            with open(self.journal_path, "ab") as f:
+                array.array("Q", self._pending).tofile(f)
+            self._pending = []
+
+    def compact(self):
+        """
+        Merges the journal into a new sorted array file and drops removed IDs.
+        The journal file is moved aside and re-read first, and the current index file
+        is re-mapped, so IDs other processes recorded since this index was loaded are
+        kept; their later appends start a new journal.
+        """
+        aside_path = self.journal_path + ".compacting"
+        if os.path.exists(self.journal_path):
+            os.replace(self.journal_path, aside_path)
+        journal = self._journal.union(self._read_journal(aside_path))
+        self.close()
+        self._open_index()
+        merged = array.array("Q")
+        last = None
+        for media_id in heapq.merge(self._ids, sorted(journal)):
+            if media_id != last and media_id not in self._removed:
+                merged.append(media_id)
+            last = media_id
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            merged.tofile(f)
+        del merged
+        self.close()
+        os.replace(tmp_path, self.index_path)
+        if os.path.exists(aside_path):
+            os.remove(aside_path)
+        self._journal = set()
+        self._pending = []
+        self._removed = set()
+        self._open_index()
+
+def processed_index_path(file_path):
+    """Path of the binary index that backs a processed-urls file (processed-urls.json → processed-urls.idx)."""
+    return os.path.splitext(file_path)[0] + ".idx"
+
 def load_processed_urls(file_path):
-    """Loads a set of processed URLs from a JSON file."""
-    if os.path.exists(file_path):
+    """
+    Loads the processed post index for a processed-urls file.
+    A legacy JSON list of URLs at file_path is migrated into the index once
+    and renamed to <file>.migrated.
+    """
+    index = ProcessedIndex(processed_index_path(file_path))
+    if os.path.exists(file_path) and not os.path.exists(index.index_path):
         try:
             with open(file_path, 'r') as f:
-                return set(json.load(f))
+                legacy_urls = json.load(f)
+            for url in legacy_urls:
+                index.add(url)
+            index.compact()
+            os.replace(file_path, file_path + ".migrated")
+            print(f"[*] Migrated {len(legacy_urls)} processed URLs from {file_path} to {index.index_path}")
         except json.JSONDecodeError:
             print(f"[*] Warning: Could not decode {file_path}. Starting with empty processed URLs.")
-            return set()
-    return set()
+    return index
 
-def save_processed_urls(file_path, processed_set):
-    """Saves a set of processed URLs to a JSON file."""
+def save_processed_urls(file_path, processed_index):
+    """Persists pending changes of a processed post index."""
     try:
-        with open(file_path, 'w') as f:
-            json.dump(list(processed_set), f) # Convert set to list for JSON serialization
+        processed_index.flush()
     except Exception as e:
-        print(f"[!] Error saving processed URLs to {file_path}: {e}")
+        print(f"[!] Error saving processed URLs to {processed_index.index_path}: {e}")
 
 def normalize_post_url(href, base_url, username):
     """
@@ -254,11 +672,9 @@ def download_video(post_url, post_dir, shortcode, label="video"):
     from yt_dlp import YoutubeDL
     # Use yt-dlp's %(title)s or %(id)s as fallback, and prefix with label
     outtmpl = os.path.join(post_dir, f"{label}_%(id)s.%(ext)s")
-    if not args.overwrite:
-        existing = [f for f in os.listdir(post_dir) if f.startswith(label) and f.endswith(('.mp4', '.webm', '.mkv'))]
-        if existing:
-            tqdm.write(f"[⏩] Skipping video download for {post_url} (video file already exists)")
-            return
+    if video_already_downloaded(post_url, post_dir, label):
+        return
+    size_before = video_files_size(post_dir)
     try:
         user_agent = driver.execute_script("return navigator.userAgent;")
         tqdm.write(f"[▶] Downloading video(s) via yt-dlp from post: {shortcode}")
@@ -273,51 +689,279 @@ def download_video(post_url, post_dir, shortcode, label="video"):
             'user_agent': user_agent,
             'noplaylist': False,  # <-- Ensure yt-dlp treats the post as a playlist
             'ignoreerrors': True,  # <-- Ignore errors for individual videos
-            'format': 'bestvideo+bestaudio/best',  # Download best quality video
+            'format': ytdlp_format_for_quality(),  # Format selector from --media-quality
+            'concurrent_fragment_downloads': args.concurrent_fragments,
             'postprocessors': [{
                 'key': 'FFmpegVideoConvertor',
                 'preferedformat': 'mp4',  # Convert to mp4 if not already
             }],
         }
         with YoutubeDL(ytdl_opts) as ytdl:
-            ytdl.download([post_url])
+            record_video_formats(ytdl.extract_info(post_url, download=True))
+        downloaded = video_files_size(post_dir) - size_before
+        if downloaded > 0:
+            MEDIA_STATS["videos"] += 1
+            MEDIA_STATS["video_bytes"] += downloaded
     except Exception as e:
         tqdm.write(f"[!] yt-dlp error: {e}")
         with open(ERROR_LOG, "a") as elog:
             elog.write(f"{post_url} — yt-dlp error: {e}\n")
+    catalog_update_video(post_dir, shortcode)
+
+def video_already_downloaded(post_url, post_dir, label="video"):
+    """True (and logs a skip) if a video file with this label exists and --overwrite is not set."""
+    if args.overwrite:
+        return False
+    existing = [f for f in os.listdir(post_dir) if f.startswith(label) and f.endswith(('.mp4', '.webm', '.mkv'))]
+    if existing:
+        tqdm.write(f"[⏩] Skipping video download for {post_url} (video file already exists)")
+        return True
+    return False
+
+class VideoJobExecutor:
+    """
+    Runs yt-dlp video downloads for several posts in parallel while the main loop
+    keeps extracting. Each job is a separate `python -m yt_dlp` process, so jobs
+    (and their ffmpeg post-processing) do not contend for our GIL. Failures are
+    appended to ERROR_LOG like download_video() does, so they are retried later.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.futures = []
+        self.lock = threading.Lock()
+        self.user_agent = None
+        self.started = time.monotonic()
+        self.completed = 0
+        self.failed = 0
+        self.total_bytes = 0
+        self.finished = []  # (post_url, seconds, succeeded) of finished jobs, drained by take_finished()
+
+    def build_command(self, post_url, post_dir, label):
+        return [
+            sys.executable, "-m", "yt_dlp",
+            "--quiet", "--no-warnings", "--no-progress",
+            # One info JSON line per video on stdout (for the quality stats); still downloads
+            "--dump-json", "--no-simulate",
+            "--cookies-from-browser", f"firefox:{PROFILE_DIR}",
+            "--user-agent", self.user_agent,
+            "--yes-playlist",
+            "--ignore-errors",
+            "--format", ytdlp_format_for_quality(),
+            "--concurrent-fragments", str(args.concurrent_fragments),
+            "--recode-video", "mp4",
+            "--output", os.path.join(post_dir, f"{label}_%(id)s.%(ext)s"),
+            post_url,
+        ]
+
+    def submit(self, post_url, post_dir, shortcode, label="video"):
+        """Queues a video download and returns True, or returns False if the video already exists."""
+        if video_already_downloaded(post_url, post_dir, label):
+            return False
+        if self.user_agent is None:
+            # WebDriver is not thread-safe, so read the user agent here on the main thread
+            self.user_agent = driver.execute_script("return navigator.userAgent;")
+        tqdm.write(f"[▶] Queued video job for post: {shortcode}")
+        self.futures.append(self.pool.submit(self._run, post_url, post_dir, shortcode, label))
+        return True
+
+    def _run(self, post_url, post_dir, shortcode, label):
+        start = time.monotonic()
+        size_before = video_files_size(post_dir)
+        try:
+            result = subprocess.run(self.build_command(post_url, post_dir, label), capture_output=True, text=True)
+            error = result.stderr.strip().splitlines()[-1] if result.returncode != 0 and result.stderr.strip() else None
+            if result.returncode != 0 and not error:
+                error = f"exit code {result.returncode}"
+        except Exception as e:
+            error = str(e)
+        elapsed = time.monotonic() - start
+        downloaded = max(0, video_files_size(post_dir) - size_before)
+        with self.lock:
+            if not error:
+                for line in result.stdout.splitlines():
+                    try:
+                        record_video_formats(json.loads(line))
+                    except ValueError:
+                        pass
+            self.total_bytes += downloaded
+            if downloaded:
+                MEDIA_STATS["videos"] += 1
+                MEDIA_STATS["video_bytes"] += downloaded
+            self.finished.append((post_url, elapsed, not error))
+            if error:
+                self.failed += 1
+                tqdm.write(f"[!] yt-dlp error for {shortcode}: {error}")
+                with open(ERROR_LOG, "a") as elog:
+                    elog.write(f"{post_url} — yt-dlp error: {error}\n")
+            else:
+                self.completed += 1
+                rate = downloaded / elapsed if elapsed > 0 else 0
+                tqdm.write(f"[✓] Video job {shortcode}: {format_bytes(downloaded)} in {elapsed:.1f}s ({format_bytes(rate)}/s)")
+
+    def take_finished(self):
+        """Returns and forgets the jobs that finished (successfully or not) since the last call."""
+        with self.lock:
+            finished, self.finished = self.finished, []
+        return finished
+
+    def wait(self):
+        """Blocks until every queued job has finished and prints aggregate throughput."""
+        if not self.futures:
+            return
+        pending = sum(1 for f in self.futures if not f.done())
+        if pending:
+            tqdm.write(f"[i] Waiting for {pending} video jobs to finish...")
+        for future in self.futures:
+            future.result()
+        self.futures = []
+        elapsed = time.monotonic() - self.started
+        tqdm.write(f"[i] Video jobs: {self.completed} ok, {self.failed} failed, {format_bytes(self.total_bytes)} "
+                   f"in {elapsed:.1f}s ({format_bytes(self.total_bytes / elapsed if elapsed > 0 else 0)}/s overall)")
+
+    def close(self):
+        """Cancels jobs that have not started yet (e.g. after Ctrl+C) and shuts the pool down."""
+        for future in self.futures:
+            future.cancel()
+        self.pool.shutdown(wait=True)
+
+def image_filepath(url, label, target_dir):
+    """Where download_images() stores an image: its sequence label plus the original filename from the URL."""
+    parsed_url = urllib.parse.urlparse(url)
+    original_filename = os.path.basename(parsed_url.path)
+    # Fallback if original filename is empty
+    if not original_filename:
+        ext = os.path.splitext(parsed_url.path)[-1]
+        original_filename = f"media{ext if ext else '.jpg'}"
+    return os.path.join(target_dir, sanitize_filename(f"{label}_{original_filename}"))
+
+def post_media_on_disk(media_items, post_dir, call_ytdlp):
+    """True if every extracted image of a post and, when one is expected, a video file exist in post_dir."""
+    if not all(os.path.exists(image_filepath(url, label, post_dir)) for url, label in media_items):
+        return False
+    has_video = any(f.endswith(('.mp4', '.webm', '.mkv')) for f in os.listdir(post_dir))
+    if call_ytdlp:
+        return has_video
+    return bool(media_items)
 
 def download_images(media_items, target_dir):
     for url, label in tqdm(media_items, desc=f"Downloading media to {os.path.basename(target_dir)}", leave=False):
         if url.startswith("blob:"):
             tqdm.write(f"[⏩] Skipping blob URL: {url}")
             continue
-        # Extract the original filename from the URL path
-        parsed_url = urllib.parse.urlparse(url)
-        original_filename = os.path.basename(parsed_url.path)
-        # Fallback if original filename is empty
-        if not original_filename:
-            ext = os.path.splitext(parsed_url.path)[-1]
-            original_filename = f"media{ext if ext else '.jpg'}"
-        # Prefix with our sequence label
-        filename = f"{label}_{original_filename}"
-        filepath = os.path.join(target_dir, sanitize_filename(filename))
+        filepath = image_filepath(url, label, target_dir)
         if not os.path.exists(filepath) or args.overwrite:
             tqdm.write(f"[↓] Downloading {url} → {filepath}")
             try:
-                with requests.get(url, stream=True, timeout=20) as r:
-                    r.raise_for_status()
-                    with open(filepath, 'wb') as f:
-                        for chunk in r.iter_content(chunk_size=8192):
-                            f.write(chunk)
+                record_image_bytes(url, fetch_to_file(url, filepath))
             except Exception as e:
                 tqdm.write(f"[!] Failed to download {url}: {e}")
         else:
             tqdm.write(f"[⏩] Skipping {url} (already exists)")
 
 # === Post scraping and downloading logic ===
-def extract_media_urls(post_url):
+# Per-field deadlines (seconds, from the start of the probe) for probe_post_page()
+PROBE_DEADLINES = {"media": 20, "timestamp": 5, "caption": 2}
+# In-page snapshot of everything extract_media_urls() needs from a post page
+POST_PROBE_JS = """
+function probe() {
+    let mediaReady = false;
+    const images = [];
+    for (const img of document.images) {
+        const rect = img.getBoundingClientRect();
+        if (rect.width > 300 && rect.height > 300) mediaReady = true;
+        if (!img.src || img.src.startsWith("blob:")) continue;
+        if (rect.width < 320 || rect.height < 300 || rect.top < 0 || rect.left < 0) continue;
+        images.push({src: img.src, srcset: img.getAttribute("srcset") || "",
+                     width: rect.width, height: rect.height, top: rect.top, left: rect.left});
+    }
+    const videos = document.getElementsByTagName("video");
+    for (const vid of videos) {
+        const rect = vid.getBoundingClientRect();
+        if (rect.width > 300 && rect.height > 300) mediaReady = true;
+    }
+    const time = document.querySelector("time");
+    const caption = document.evaluate('//article//h1[contains(@class, "_ap3a")]', document, null,
+                                      XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+    return {
+        media_ready: mediaReady,
+        timestamp: time ? time.getAttribute("datetime") : null,
+        caption: caption ? caption.innerText.trim() : null,
+        images: images,
+        has_video: videos.length > 0,
+    };
+}
+"""
+# Polls probe() until every field is found or has hit its own deadline, then returns in one round trip.
+# Snapshots are only taken once the tab shows the expected post: a preloaded tab may still hold the
+# previous page, whose media, <time> and caption must not be saved under the new shortcode.
+# Field deadlines count from that moment; if the post never shows up within the media deadline,
+# an empty result with on_post = false is returned.
+POST_PROBE_WAIT_JS = POST_PROBE_JS + """
+const [mediaMs, timestampMs, captionMs, shortcode] = arguments;
+const done = arguments[arguments.length - 1];
+const start = performance.now();
+let pageStart = null;
+function poll() {
+    if (pageStart === null) {
+        if (location.pathname.includes("/" + shortcode) && document.readyState !== "loading") {
+            pageStart = performance.now();
+        } else if (performance.now() - start >= mediaMs) {
+            done({media_ready: false, timestamp: null, caption: null, images: [], has_video: false, on_post: false});
+            return;
+        } else {
+            setTimeout(poll, 100);
+            return;
+        }
+    }
+    const result = probe();
+    result.on_post = true;
+    const elapsed = performance.now() - pageStart;
+    if ((result.media_ready || elapsed >= mediaMs) &&
+        (result.timestamp !== null || elapsed >= timestampMs) &&
+        (result.caption !== null || elapsed >= captionMs)) {
+        result.elapsed_ms = Math.round(elapsed);
+        done(result);
+    } else {
+        setTimeout(poll, 100);
+    }
+}
+poll();
+"""
+
+def probe_post_page(shortcode):
+    """
+    Waits in-page for the post's main media, <time> tag and caption, each with its
+    own deadline, and returns them with the candidate images and video presence
+    in a single WebDriver round trip. Only the page of the given shortcode is probed.
+    """
+    # Waiting for the post to appear can take up to the media deadline on top of the field deadlines
+    driver.set_script_timeout(PROBE_DEADLINES["media"] + max(PROBE_DEADLINES.values()) + 10)
+    deadline = time.monotonic() + PROBE_DEADLINES["media"]
+    while True:
+        try:
+            return driver.execute_async_script(
+                POST_PROBE_WAIT_JS,
+                PROBE_DEADLINES["media"] * 1000,
+                PROBE_DEADLINES["timestamp"] * 1000,
+                PROBE_DEADLINES["caption"] * 1000,
+                shortcode,
+            )
+        except WebDriverException as e:
+            # A navigation committing mid-probe unloads the document the script ran in; probe the new one
+            if time.monotonic() >= deadline or is_driver_crash(e):
+                raise
+            time.sleep(0.2)
+
+def extract_media_urls(post_url, navigate=True):
+    """
+    Extracts a post from the browser. With navigate=False the current tab is
+    expected to be loading post_url already (see TabPool) and is only probed.
+    """
     print(f"[→] {post_url}")
-    driver.get(post_url)
+    if navigate:
+        driver.get(post_url)
     media_items = []
     seen_urls = set()
     actions = ActionChains(driver)
@@ -325,31 +969,27 @@ def extract_media_urls(post_url):
     shortcode = post_url.rstrip('/').split('/')[-1]
 
     tqdm.write(f"[i] Extracting media from post: {shortcode}")
+    # Wait for main media, <time> and caption in a single in-page probe
+    tqdm.write(f"[i] Probing page for main media, <time> tag and caption...")
     try:
-        # Wait for a large <img> or <video> tag to appear
-        tqdm.write(f"[i] Waiting for main media element (<img> or <video>)...")
-        WebDriverWait(driver, 20).until(
-            lambda d: any(
-                (img.size['width'] > 300 and img.size['height'] > 300)
-                for img in d.find_elements(By.TAG_NAME, "img")
-            ) or any(
-                (vid.size['width'] > 300 and vid.size['height'] > 300)
-                for vid in d.find_elements(By.TAG_NAME, "video")
-            )
-        )
+        probe = probe_post_page(shortcode)
     except Exception as e:
-        tqdm.write(f"[!] Warning: Could not find main media element on {post_url}. Error: {e}")
+        if is_driver_crash(e):
+            raise
+        tqdm.write(f"[!] Warning: Page probe failed on {post_url}. Error: {e}")
+        probe = {"media_ready": False, "timestamp": None, "caption": None, "images": [], "has_video": False, "on_post": False}
+    if not probe["on_post"]:
+        tqdm.write(f"[!] Warning: {post_url} did not load within {PROBE_DEADLINES['media']}s.")
+    elif not probe["media_ready"]:
+        tqdm.write(f"[!] Warning: Could not find main media element on {post_url} within {PROBE_DEADLINES['media']}s.")
 
-    # Try to find the time element, but fallback if not found
-    tqdm.write(f"[i] Looking for <time> tag...")
+    # Use the <time> tag if found, but fallback if not
     try:
-        time_elem = WebDriverWait(driver, 5).until(
-            EC.presence_of_element_located((By.TAG_NAME, "time"))
-        )
-        timestamp_raw = time_elem.get_attribute("datetime")
+        timestamp_raw = probe["timestamp"]
         timestamp_prefix = datetime.fromisoformat(timestamp_raw.replace("Z", "+00:00")).strftime("%Y%m%d")
     except Exception as e:
         tqdm.write(f"[!] Warning: Could not find time element on {post_url} after wait. Using current time. Error: {e}")
+        INCOMPLETE_EXTRACTIONS.add(post_url)
         timestamp_raw = datetime.now().isoformat()
         timestamp_prefix = datetime.now().strftime("%Y%m%d")
     tqdm.write(f"[i] Timestamp found: {timestamp_raw}")
@@ -357,55 +997,38 @@ def extract_media_urls(post_url):
     post_dir = os.path.join(DOWNLOAD_ROOT, SESSION_NAME, post_dir_name)
     os.makedirs(post_dir, exist_ok=True)
 
-    caption = ""
-    try:
-        # Try to extract the caption from the h1 tag with known class pattern
-        caption_elem = WebDriverWait(driver, 5).until(
-            EC.presence_of_element_located((By.XPATH, '//article//h1[contains(@class, "_ap3a")]'))
-        )
-        caption = caption_elem.text.strip()
-    except TimeoutException:
-        caption = ""
-    except Exception as e:
-        print(f"[*] An unexpected error occurred while getting caption: {e}")
-        caption = ""
+    # Caption comes from the h1 tag with known class pattern (None if it never appeared)
+    caption = probe["caption"] or ""
         
     metadata = {
         "url": post_url,
         "shortcode": shortcode,
+        "username": args.username,
         "caption": caption,
         "timestamp": timestamp_raw
     }
-    with open(os.path.join(post_dir, "metadata.json"), "w") as meta_file:
-        json.dump(metadata, meta_file, indent=2)
+    write_post_metadata(post_dir, metadata)
 
     index = 1
     video_detected = False
 
     # Only collect images for manual download
-    def collect_images():
+    def collect_images(page):
         nonlocal index, video_detected
-        img_tags = driver.find_elements(By.TAG_NAME, "img")
-        for img in img_tags:
-            url = img.get_attribute("src")
-            if not url or url in seen_urls or url.startswith("blob:"):
-                continue
-            box = driver.execute_script("""
-                const rect = arguments[0].getBoundingClientRect();
-                return {width: rect.width, height: rect.height, top: rect.top, left: rect.left};
-            """, img)
-            if box["width"] < 320 or box["height"] < 300:
-                continue
-            if box["top"] < 0 or box["left"] < 0:
+        # page["images"] is already filtered in-page to large, on-screen, non-blob images
+        for img in page["images"]:
+            src = img["src"]
+            if src in seen_urls:
                 continue
-            seen_urls.add(url)
+            seen_urls.add(src)
+            # Pick the srcset rendition matching --media-quality (falls back to src)
+            url = pick_image_url(src, img["srcset"], img["width"])
             label = f"image_{index:02d}"
             media_items.append((url, label))
             index += 1
 
         # Detect if any <video> is present in the post (for yt-dlp)
-        videos = driver.find_elements(By.TAG_NAME, "video")
-        if videos:
+        if page["has_video"]:
             video_detected = True
 
     # Carousel navigation loop (as before)
@@ -413,7 +1036,8 @@ def extract_media_urls(post_url):
     slide_count = 1
     while True:
         tqdm.write(f"[→] Processing slide {slide_count}")
-        collect_images()
+        # The first slide reuses the initial probe; later slides need a fresh (non-waiting) snapshot
+        collect_images(probe if slide_count == 1 else driver.execute_script(POST_PROBE_JS + "return probe();"))
         try:
             next_button = WebDriverWait(driver, 2).until(
                 EC.element_to_be_clickable((By.XPATH, next_button_xpath))
@@ -425,19 +1049,1491 @@ def extract_media_urls(post_url):
             tqdm.write("[✓] Reached end of carousel or no next button")
             break
 
+    write_media_urls(post_dir, media_items)
+    if not media_items and not video_detected:
+        INCOMPLETE_EXTRACTIONS.add(post_url)
+
+    call_ytdlp = video_detected or not media_items
+    catalog_add_post(post_dir, metadata, media_items)
+    return media_items, post_dir, call_ytdlp
+
+def write_post_metadata(post_dir, metadata):
+    """Writes metadata.json for a post directory."""
+    with open(os.path.join(post_dir, "metadata.json"), "w") as meta_file:
+        json.dump(metadata, meta_file, indent=2)
+
+def write_media_urls(post_dir, media_items):
+    """Writes media_urls.txt (one "label: url" line per item) for a post directory."""
     with open(os.path.join(post_dir, "media_urls.txt"), "w") as f:
         for url, label in media_items:
             f.write(f"{label}: {url}\n")
 
+# === Browserless HTTP extraction backend ===
+IG_APP_ID = "936619743392459"  # Public web app ID sent by instagram.com itself
+http_session = None
+
+def load_profile_cookies(profile_dir):
+    """
+    Exports instagram.com cookies from a Firefox profile's cookies.sqlite.
+    The database (and its WAL) is copied first so a running Firefox does not lock us out.
+    """
+    cookie_db = os.path.join(profile_dir, "cookies.sqlite")
+    if not os.path.exists(cookie_db):
+        return []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(cookie_db + suffix):
+                shutil.copy2(cookie_db + suffix, os.path.join(tmp_dir, "cookies.sqlite" + suffix))
+        conn = sqlite3.connect(os.path.join(tmp_dir, "cookies.sqlite"))
+        try:
+            rows = conn.execute(
+                "SELECT host, name, value, path, isSecure FROM moz_cookies WHERE host LIKE '%instagram.com'"
+            ).fetchall()
+        finally:
+            conn.close()
+    return [
+        {"domain": host, "name": name, "value": value, "path": path, "secure": bool(secure)}
+        for host, name, value, path, secure in rows
+    ]
+
+def get_http_session():
+    """Builds (once) a pooled requests.Session carrying the logged-in profile cookies."""
+    global http_session
+    if http_session is not None:
+        return http_session
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=2)
+    session.mount("https://", adapter)
+    cookies = load_profile_cookies(PROFILE_DIR)
+    for cookie in cookies:
+        session.cookies.set(cookie["name"], cookie["value"], domain=cookie["domain"], path=cookie["path"], secure=cookie["secure"])
+    session.headers.update({
+        "User-Agent": driver.execute_script("return navigator.userAgent;"),
+        "X-IG-App-ID": IG_APP_ID,
+        "X-CSRFToken": session.cookies.get("csrftoken", domain=".instagram.com") or "",
+        "X-Requested-With": "XMLHttpRequest",
+        "Referer": BASE_URL + "/",
+    })
+    tqdm.write(f"[i] HTTP backend: exported {len(cookies)} instagram.com cookies from {PROFILE_DIR}")
+    http_session = session
+    return http_session
+
+def extract_media_urls_http(post_url):
+    """
+    Extracts a post over plain HTTP via the media info API.
+    Returns the same (media_items, post_dir, call_ytdlp) tuple as extract_media_urls(),
+    and raises on any failure so the caller can fall back to the browser.
+    """
+    shortcode = post_url.rstrip('/').split('/')[-1]
+    media_id = shortcode_to_media_id(shortcode)
+    r = get_http_session().get(f"{BASE_URL}/api/v1/media/{media_id}/info/", timeout=15, allow_redirects=False)
+    r.raise_for_status()
+    items = r.json().get("items") or []
+    if not items:
+        raise ValueError(f"no items in media info response for {shortcode}")
+    item = items[0]
+
+    taken_at = datetime.fromtimestamp(item["taken_at"], tz=timezone.utc)
+    timestamp_raw = taken_at.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+    post_dir = os.path.join(DOWNLOAD_ROOT, SESSION_NAME, f"{taken_at.strftime('%Y%m%d')}_{shortcode}")
+    os.makedirs(post_dir, exist_ok=True)
+    caption = ((item.get("caption") or {}).get("text") or "").strip()
+    metadata = {
+        "url": post_url,
+        "shortcode": shortcode,
+        "username": args.username,
+        "caption": caption,
+        "timestamp": timestamp_raw
+    }
+    write_post_metadata(post_dir, metadata)
+
+    media_items = []
+    video_detected = False
+    for node in item.get("carousel_media") or [item]:
+        if node.get("video_versions"):
+            video_detected = True
+            continue
+        candidates = [
+            (c["url"], c.get("width") or 0)
+            for c in (node.get("image_versions2") or {}).get("candidates", [])
+        ]
+        choice = select_media_rendition(candidates)
+        if choice:
+            media_items.append((choice[0], f"image_{len(media_items) + 1:02d}"))
+    write_media_urls(post_dir, media_items)
+    if not media_items and not video_detected:
+        INCOMPLETE_EXTRACTIONS.add(post_url)
+    tqdm.write(f"[i] HTTP backend: {shortcode} → {len(media_items)} images{' + video' if video_detected else ''}")
+
     call_ytdlp = video_detected or not media_items
+    catalog_add_post(post_dir, metadata, media_items)
     return media_items, post_dir, call_ytdlp
 
+def extract_post(post_url):
+    """Extracts a post, reusing a fresh extraction cache entry instead of loading the page when possible."""
+    cached = extract_cache_get(post_url)
+    if cached:
+        return cached
+    INCOMPLETE_EXTRACTIONS.discard(post_url)
+    result = extract_post_live(post_url)
+    # Fallback timestamps and empty pages must be extracted again next time, not replayed
+    if post_url not in INCOMPLETE_EXTRACTIONS:
+        extract_cache_put(post_url, *result)
+    return result
+
+def extract_post_live(post_url):
+    """Extracts a post with the configured backend, falling back to the browser if the HTTP fetch fails."""
+    if args.extraction_backend == "http":
+        try:
+            return extract_media_urls_http(post_url)
+        except Exception as e:
+            tqdm.write(f"[!] HTTP extraction failed for {post_url}, falling back to Selenium: {e}")
+    ensure_driver_healthy()
+    DRIVER_STATS["pages"] += 1
+    DRIVER_STATS["total_pages"] += 1
+    try:
+        preloaded = tab_pool.activate(post_url) if tab_pool else False
+        return extract_media_urls(post_url, navigate=not preloaded)
+    except Exception as e:
+        if not is_driver_crash(e):
+            raise
+        tqdm.write(f"[!] Browser crashed while extracting {post_url}: {e}")
+        restart_driver("crash")
+        DRIVER_STATS["crash_restarts"] += 1
+        DRIVER_STATS["pages"] += 1
+        DRIVER_STATS["total_pages"] += 1
+        return extract_media_urls(post_url)
+
+# === Extraction cache ===
+# One JSON file per shortcode holding what extract_post() returned, so retries and
+# re-runs can skip navigation while the signed CDN URLs are still valid.
+EXTRACT_CACHE_DIR = os.path.join(DOWNLOAD_ROOT, ".extract-cache")
+EXTRACT_CACHE_STATS = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0}
+CDN_EXPIRY_MARGIN = 600  # seconds; don't hand out URLs that are about to expire
+extract_cache_size = None  # running total of cache bytes, computed on first store
+# Post URLs whose last live extraction found no media or fell back to the current time; never cached
+INCOMPLETE_EXTRACTIONS = set()
+
+def cdn_url_expiry(url):
+    """Returns the expiry epoch encoded in an Instagram CDN URL's 'oe' (hex) parameter, or None."""
+    oe = urllib.parse.parse_qs(urllib.parse.urlparse(url).query).get("oe")
+    try:
+        return int(oe[0], 16) if oe else None
+    except ValueError:
+        return None
+
+def extract_cache_path(post_url):
+    # Keyed by session as well, since the same post lives in a different directory per account
+    shortcode = post_url.rstrip('/').split('/')[-1]
+    return os.path.join(EXTRACT_CACHE_DIR, sanitize_filename(f"{SESSION_NAME}__{shortcode}.json"))
+
+def extract_cache_get(post_url):
+    """Returns a cached (media_items, post_dir, call_ytdlp) tuple if a fresh entry exists, else None."""
+    if not args.extract_cache_ttl:
+        return None
+    path = extract_cache_path(post_url)
+    try:
+        with open(path) as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        EXTRACT_CACHE_STATS["misses"] += 1
+        return None
+    if entry["expires"] <= time.time():
+        EXTRACT_CACHE_STATS["expired"] += 1
+        EXTRACT_CACHE_STATS["misses"] += 1
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+    post_dir = os.path.join(DOWNLOAD_ROOT, entry["post_dir"])
+    media_items = [tuple(item) for item in entry["media_items"]]
+    if not os.path.exists(os.path.join(post_dir, "metadata.json")):
+        # The post directory was removed (e.g. by --cleanup-and-retry); recreate it from the cache
+        os.makedirs(post_dir, exist_ok=True)
+        write_post_metadata(post_dir, entry["metadata"])
+        write_media_urls(post_dir, media_items)
+    os.utime(path)  # mtime doubles as the LRU timestamp
+    EXTRACT_CACHE_STATS["hits"] += 1
+    tqdm.write(f"[i] Extraction cache hit for {post_url}, skipping page load")
+    return media_items, post_dir, entry["call_ytdlp"]
+
+def extract_cache_drop(post_url):
+    """Removes a post's cache entry so its next extraction loads the page again."""
+    try:
+        os.remove(extract_cache_path(post_url))
+    except OSError:
+        pass
+
+def extract_cache_put(post_url, media_items, post_dir, call_ytdlp):
+    """Stores an extraction result; it expires after the TTL or when its first CDN URL does, whichever is sooner."""
+    global extract_cache_size
+    if not args.extract_cache_ttl:
+        return
+    now = time.time()
+    expires = now + args.extract_cache_ttl
+    for url, _ in media_items:
+        cdn_expiry = cdn_url_expiry(url)
+        if cdn_expiry:
+            expires = min(expires, cdn_expiry - CDN_EXPIRY_MARGIN)
+    if expires <= now:
+        return
+    try:
+        with open(os.path.join(post_dir, "metadata.json")) as f:
+            metadata = json.load(f)
+        os.makedirs(EXTRACT_CACHE_DIR, exist_ok=True)
+        path = extract_cache_path(post_url)
+        with open(path, "w") as f:
+            json.dump({
+                "post_url": post_url,
+                "created": now,
+                "expires": expires,
+                "post_dir": os.path.relpath(post_dir, DOWNLOAD_ROOT),
+                "metadata": metadata,
+                "media_items": media_items,
+                "call_ytdlp": call_ytdlp,
+            }, f)
+    except (OSError, ValueError) as e:
+        tqdm.write(f"[!] Could not write extraction cache for {post_url}: {e}")
+        return
+    if extract_cache_size is None:
+        extract_cache_size = sum(e.stat().st_size for e in os.scandir(EXTRACT_CACHE_DIR) if e.is_file())
+    else:
+        extract_cache_size += os.path.getsize(path)
+    if extract_cache_size > args.extract_cache_max_mb * 1024 * 1024:
+        evict_extract_cache()
+
+def evict_extract_cache():
+    """Drops expired entries, then least recently used ones, until the cache is under 90% of its size limit."""
+    global extract_cache_size
+    now = time.time()
+    entries = []
+    for entry in os.scandir(EXTRACT_CACHE_DIR):
+        if entry.is_file():
+            st = entry.stat()
+            entries.append((st.st_mtime, st.st_size, entry.path))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    limit = args.extract_cache_max_mb * 1024 * 1024 * 0.9
+    for mtime, size, path in entries:
+        if total <= limit and now - mtime < args.extract_cache_ttl:
+            # Entries are in LRU order, so nothing older remains once we are under the limit and inside the TTL
+            break
+        try:
+            os.remove(path)
+            total -= size
+            EXTRACT_CACHE_STATS["evicted"] += 1
+        except OSError:
+            pass
+    extract_cache_size = total
+
+def report_extract_cache_stats():
+    lookups = EXTRACT_CACHE_STATS["hits"] + EXTRACT_CACHE_STATS["misses"]
+    if not lookups:
+        return
+    print(f"[i] Extraction cache: {EXTRACT_CACHE_STATS['hits']}/{lookups} hits, "
+          f"{EXTRACT_CACHE_STATS['expired']} expired, {EXTRACT_CACHE_STATS['evicted']} evicted")
+
+# === WebDriver health and recycling ===
+DRIVER_STATS = {
+    "pages": 0,           # post pages loaded by the current browser
+    "total_pages": 0,
+    "recycles": 0,        # planned restarts (page count, memory, unresponsive)
+    "crash_restarts": 0,
+    "peak_rss": 0,
+}
+
+def firefox_rss_bytes():
+    """
+    Resident memory of the Firefox parent process plus all of its content processes.
+    Uses psutil if it is installed, otherwise /proc (Linux). Returns None if unavailable.
+    """
+    try:
+        pid = driver.capabilities.get("moz:processID")
+    except Exception:
+        return None
+    if not pid:
+        return None
+    try:
+        import psutil
+        parent = psutil.Process(pid)
+        return sum(p.memory_info().rss for p in [parent] + parent.children(recursive=True))
+    except ImportError:
+        pass
+    except Exception:
+        return None
+    if not os.path.isdir("/proc"):
+        return None
+    children = {}
+    rss_pages = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces, so split after its closing parenthesis
+                fields = f.read().rsplit(")", 1)[1].split()
+            with open(f"/proc/{entry}/statm") as f:
+                rss_pages[int(entry)] = int(f.read().split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(int(fields[1]), []).append(int(entry))
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        total += rss_pages.get(current, 0)
+        stack.extend(children.get(current, []))
+    return total * os.sysconf("SC_PAGE_SIZE") if total else None
+
+def driver_is_responsive():
+    """True if the browser still answers a trivial script."""
+    try:
+        return driver.execute_script("return 1;") == 1
+    except Exception:
+        return False
+
+def is_driver_crash(error):
+    """True if an exception means the browser or geckodriver is gone, rather than a page-level failure."""
+    if isinstance(error, (InvalidSessionIdException, NoSuchWindowException)):
+        return True
+    message = str(error).lower()
+    if any(hint in message for hint in ("failed to decode response", "connection refused", "session deleted",
+                                        "browsing context has been discarded", "max retries exceeded",
+                                        "tried to run command without establishing a connection")):
+        return True
+    return isinstance(error, WebDriverException) and not driver_is_responsive()
+
+def restart_driver(reason):
+    """Quits the current browser (ignoring errors if it already died) and launches a fresh one."""
+    global driver
+    tqdm.write(f"[↻] Restarting Firefox ({reason}) after {DRIVER_STATS['pages']} pages...")
+    try:
+        driver.quit()
+    except Exception:
+        pass
+    driver = launch_driver()
+    DRIVER_STATS["pages"] = 0
+    if tab_pool:
+        tab_pool.reset()
+
+def ensure_driver_healthy():
+    """Recycles the browser when it hits the page limit, exceeds the RSS limit or stops responding."""
+    if args.recycle_after_pages and DRIVER_STATS["pages"] >= args.recycle_after_pages:
+        restart_driver(f"page limit {args.recycle_after_pages}")
+        DRIVER_STATS["recycles"] += 1
+        return
+    rss = firefox_rss_bytes()
+    if rss:
+        DRIVER_STATS["peak_rss"] = max(DRIVER_STATS["peak_rss"], rss)
+        if args.max_browser_rss and rss > args.max_browser_rss * 1024 * 1024:
+            restart_driver(f"RSS {format_bytes(rss)} over {args.max_browser_rss} MB")
+            DRIVER_STATS["recycles"] += 1
+            return
+    if not driver_is_responsive():
+        restart_driver("unresponsive")
+        DRIVER_STATS["recycles"] += 1
+
+def report_driver_stats():
+    """Prints browser page, restart and memory figures for the run."""
+    if not DRIVER_STATS["total_pages"]:
+        return
+    peak = format_bytes(DRIVER_STATS["peak_rss"]) if DRIVER_STATS["peak_rss"] else "n/a"
+    print(f"[i] Browser: {DRIVER_STATS['total_pages']} post pages, {DRIVER_STATS['recycles']} recycles, "
+          f"{DRIVER_STATS['crash_restarts']} crash restarts, peak Firefox RSS {peak}")
+
+# === Multi-tab extraction (--tabs) ===
+tab_pool = None  # TabPool while a profile run uses --tabs > 1
+
+class TabPool:
+    """
+    Pipelines post page loads across several tabs of the one browser. Upcoming
+    posts are started in idle tabs with a non-blocking location change, so they
+    load while the current post is being probed; extraction switches to a tab
+    only when its post is next, and the in-page probe waits for whatever is
+    still rendering.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.reset()
+
+    def reset(self):
+        """Opens the extra tabs on the current driver (called again after every browser restart)."""
+        self.handles = [driver.current_window_handle]
+        for _ in range(self.size - 1):
+            driver.switch_to.new_window("tab")
+            self.handles.append(driver.current_window_handle)
+        driver.switch_to.window(self.handles[0])
+        self.loading = {}  # window handle -> post URL it is loading
+
+    def prefetch(self, current_url, upcoming):
+        """
+        Starts loading the first upcoming posts (in order) in idle tabs, keeping any tab
+        already loading current_url; tabs loading anything else are freed. current_url
+        itself is never started here: a navigation begun just before extraction has not
+        committed yet, so activate() leaves it to a regular driver.get().
+        """
+        upcoming = upcoming[:self.size - 1]
+        for handle, url in list(self.loading.items()):
+            if url != current_url and url not in upcoming:
+                del self.loading[handle]
+        current = driver.current_window_handle
+        for url in upcoming:
+            if url in self.loading.values():
+                continue
+            idle = [handle for handle in self.handles if handle not in self.loading]
+            if not idle:
+                break
+            driver.switch_to.window(idle[0])
+            driver.execute_script("window.location.href = arguments[0];", url)
+            self.loading[idle[0]] = url
+        driver.switch_to.window(current)
+
+    def activate(self, url):
+        """Switches to the tab loading url and returns True, or to a free tab and returns False so the caller navigates."""
+        for handle, loading_url in list(self.loading.items()):
+            if loading_url == url:
+                del self.loading[handle]
+                driver.switch_to.window(handle)
+                return True
+        idle = [handle for handle in self.handles if handle not in self.loading]
+        handle = idle[0] if idle else self.handles[0]
+        self.loading.pop(handle, None)
+        driver.switch_to.window(handle)
+        return False
+
+    def close(self):
+        """Closes the extra tabs, leaving the browser on its first tab."""
+        for handle in self.handles[1:]:
+            try:
+                driver.switch_to.window(handle)
+                driver.close()
+            except WebDriverException:
+                pass
+        driver.switch_to.window(self.handles[0])
+
+class Lookahead:
+    """Iterates items while exposing the next few, pulled ahead of time, through upcoming()."""
+
+    def __init__(self, items, size):
+        self.items = iter(items)
+        self.size = size
+        self.buffer = deque()
+
+    def __iter__(self):
+        while True:
+            if not self.buffer:
+                try:
+                    self.buffer.append(next(self.items))
+                except StopIteration:
+                    return
+            yield self.buffer.popleft()
+
+    def upcoming(self):
+        while len(self.buffer) < self.size:
+            try:
+                self.buffer.append(next(self.items))
+            except StopIteration:
+                break
+        return list(self.buffer)
+
+def tab_prefetch_candidates(urls, processed_urls):
+    """Upcoming posts worth preloading: not processed yet and not answered by the extraction cache."""
+    return [url for url in urls if url not in processed_urls and not (args.extract_cache_ttl and os.path.exists(extract_cache_path(url)))]
+
+# === Metadata catalog ===
+# One SQLite database per download root, indexed for queries by account, date and shortcode.
+CATALOG_FILE = os.path.join(DOWNLOAD_ROOT, "catalog.sqlite")
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS posts (
+    shortcode   TEXT NOT NULL,
+    username    TEXT,
+    session     TEXT NOT NULL,
+    url         TEXT,
+    timestamp   TEXT,
+    caption     TEXT,
+    post_dir    TEXT,
+    media_count INTEGER,
+    has_video   INTEGER,
+    PRIMARY KEY (session, shortcode)
+);
+CREATE INDEX IF NOT EXISTS posts_shortcode ON posts (shortcode);
+CREATE INDEX IF NOT EXISTS posts_username_timestamp ON posts (username, timestamp);
+CREATE INDEX IF NOT EXISTS posts_timestamp ON posts (timestamp);
+CREATE TABLE IF NOT EXISTS stories (
+    path        TEXT PRIMARY KEY,
+    username    TEXT,
+    timestamp   TEXT,
+    media_type  TEXT,
+    media_url   TEXT,
+    slide_index INTEGER
+);
+CREATE INDEX IF NOT EXISTS stories_username_timestamp ON stories (username, timestamp);
+CREATE INDEX IF NOT EXISTS stories_timestamp ON stories (timestamp);
+"""
+# Catalogs created when posts were keyed by shortcode alone kept one row per collab post
+CATALOG_MIGRATE_POSTS = """
+BEGIN;
+ALTER TABLE posts RENAME TO posts_by_shortcode;
+DROP INDEX IF EXISTS posts_username_timestamp;
+DROP INDEX IF EXISTS posts_timestamp;
+""" + CATALOG_SCHEMA + """
+INSERT OR REPLACE INTO posts SELECT * FROM posts_by_shortcode;
+DROP TABLE posts_by_shortcode;
+COMMIT;
+"""
+catalog_conn = None
+
+def get_catalog():
+    """Opens (once) the catalog database, creating the schema if needed."""
+    global catalog_conn
+    if catalog_conn is None:
+        catalog_conn = sqlite3.connect(CATALOG_FILE, timeout=30)
+        catalog_conn.execute("PRAGMA journal_mode=WAL")
+        primary_key = [col[1] for col in sorted(catalog_conn.execute("PRAGMA table_info(posts)"), key=lambda col: col[5]) if col[5]]
+        catalog_conn.executescript(CATALOG_MIGRATE_POSTS if primary_key == ["shortcode"] else CATALOG_SCHEMA)
+    return catalog_conn
+
+def post_catalog_row(post_dir, metadata, media_count, has_video):
+    return (
+        metadata.get("shortcode"),
+        metadata.get("username"),
+        os.path.relpath(post_dir, DOWNLOAD_ROOT).split(os.sep)[0],
+        metadata.get("url"),
+        metadata.get("timestamp"),
+        metadata.get("caption"),
+        os.path.relpath(post_dir, DOWNLOAD_ROOT),
+        media_count,
+        int(bool(has_video)),
+    )
+
+def story_catalog_row(story_dir, metadata):
+    return (
+        os.path.relpath(os.path.join(story_dir, metadata.get("filename", "")), DOWNLOAD_ROOT),
+        metadata.get("username"),
+        metadata.get("timestamp"),
+        metadata.get("media_type"),
+        metadata.get("media_url"),
+        metadata.get("slide_index"),
+    )
+
+def catalog_add_post(post_dir, metadata, media_items):
+    """
+    Records (or updates) one post in the catalog, keyed by session and shortcode so a
+    collab saved for several accounts keeps a row per account. Catalog errors never interrupt scraping.
+    has_video means "a video file is in the post directory", as in rebuild_catalog();
+    catalog_update_video() refreshes it once the post's video download has finished.
+    """
+    if args.no_catalog:
+        return
+    has_video = any(f.endswith(('.mp4', '.webm', '.mkv')) for f in os.listdir(post_dir))
+    try:
+        with get_catalog() as conn:
+            conn.execute("INSERT OR REPLACE INTO posts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         post_catalog_row(post_dir, metadata, len(media_items), has_video))
+    except sqlite3.Error as e:
+        tqdm.write(f"[!] Could not update catalog for {metadata.get('shortcode')}: {e}")
+
+def catalog_update_video(post_dir, shortcode):
+    """Re-reads whether a post directory holds a video file after its yt-dlp download finished."""
+    if args.no_catalog:
+        return
+    has_video = any(f.endswith(('.mp4', '.webm', '.mkv')) for f in os.listdir(post_dir))
+    session = os.path.relpath(post_dir, DOWNLOAD_ROOT).split(os.sep)[0]
+    try:
+        with get_catalog() as conn:
+            conn.execute("UPDATE posts SET has_video = ? WHERE session = ? AND shortcode = ?", (int(has_video), session, shortcode))
+    except sqlite3.Error as e:
+        tqdm.write(f"[!] Could not update catalog for {shortcode}: {e}")
+
+def catalog_add_story(story_dir, metadata):
+    """Records one story slide in the catalog."""
+    if args.no_catalog:
+        return
+    try:
+        with get_catalog() as conn:
+            conn.execute("INSERT OR REPLACE INTO stories VALUES (?, ?, ?, ?, ?, ?)", story_catalog_row(story_dir, metadata))
+    except sqlite3.Error as e:
+        tqdm.write(f"[!] Could not update catalog for story {metadata.get('filename')}: {e}")
+
+def read_catalog_dir(path):
+    """Parses one post or story directory into catalog rows: returns (post_rows, story_rows)."""
+    post_rows, story_rows = [], []
+    try:
+        names = os.listdir(path)
+    except OSError:
+        return post_rows, story_rows
+    if "metadata.json" in names:
+        try:
+            with open(os.path.join(path, "metadata.json")) as f:
+                metadata = json.load(f)
+            media_count = 0
+            if "media_urls.txt" in names:
+                with open(os.path.join(path, "media_urls.txt")) as f:
+                    media_count = sum(1 for line in f if line.strip())
+            has_video = any(n.endswith(('.mp4', '.webm', '.mkv')) for n in names)
+            if not metadata.get("username"):
+                # Older metadata.json files predate the username field; use the session directory name
+                metadata["username"] = os.path.relpath(path, DOWNLOAD_ROOT).split(os.sep)[0]
+            post_rows.append(post_catalog_row(path, metadata, media_count, has_video))
+        except (OSError, ValueError) as e:
+            tqdm.write(f"[!] Skipping unreadable post metadata in {path}: {e}")
+    elif os.path.basename(path).startswith("stories_"):
+        for name in names:
+            if not (name.startswith("story_") and name.endswith(".json")):
+                continue
+            try:
+                with open(os.path.join(path, name)) as f:
+                    story_rows.append(story_catalog_row(path, json.load(f)))
+            except (OSError, ValueError) as e:
+                tqdm.write(f"[!] Skipping unreadable story metadata {name}: {e}")
+    return post_rows, story_rows
+
+def rebuild_catalog():
+    """Re-ingests every post and story directory under DOWNLOAD_ROOT into the catalog, parsing directories in parallel."""
+    dirs = []
+    with os.scandir(DOWNLOAD_ROOT) as sessions:
+        for session in sessions:
+            if not session.is_dir() or session.name.startswith("."):
+                continue
+            with os.scandir(session.path) as entries:
+                # Symlinked post dirs (--global-index) are catalogued under their canonical session
+                dirs.extend(e.path for e in entries if e.is_dir(follow_symlinks=False))
+    tqdm.write(f"[+] Rebuilding catalog from {len(dirs)} directories under {DOWNLOAD_ROOT}")
+    post_rows, story_rows = [], []
+    with ThreadPoolExecutor(max_workers=args.verify_workers) as pool:
+        for posts, stories in tqdm(pool.map(read_catalog_dir, dirs), total=len(dirs), desc="Reading Metadata", leave=False):
+            post_rows.extend(posts)
+            story_rows.extend(stories)
+    with get_catalog() as conn:
+        conn.execute("DELETE FROM posts")
+        conn.execute("DELETE FROM stories")
+        conn.executemany("INSERT OR REPLACE INTO posts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", post_rows)
+        conn.executemany("INSERT OR REPLACE INTO stories VALUES (?, ?, ?, ?, ?, ?)", story_rows)
+    tqdm.write(f"[✓] Catalog rebuilt: {len(post_rows)} posts, {len(story_rows)} stories → {CATALOG_FILE}")
+
+def query_catalog():
+    """Prints (or exports) catalog entries filtered by --username, --since and --until."""
+    if not os.path.exists(CATALOG_FILE):
+        print(f"[!] No catalog at {CATALOG_FILE}. Run with --catalog-rebuild to create it from existing downloads.")
+        return
+    table = args.catalog_kind
+    clauses, params = [], []
+    if args.username:
+        clauses.append("username = ?")
+        params.append(args.username)
+    if args.since:
+        clauses.append("timestamp >= ?")
+        params.append(args.since)
+    if args.until:
+        # Prefix comparison makes --until inclusive at whatever precision was given
+        clauses.append("substr(timestamp, 1, ?) <= ?")
+        params.extend([len(args.until), args.until])
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+    cursor = get_catalog().execute(f"SELECT * FROM {table}{where} ORDER BY timestamp", params)
+    columns = [c[0] for c in cursor.description]
+    rows = [dict(zip(columns, row)) for row in cursor]
+
+    out = open(args.catalog_export, "w", newline="") if args.catalog_export else sys.stdout
+    try:
+        if args.catalog_format == "csv":
+            writer = csv.DictWriter(out, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            json.dump(rows, out, indent=2, ensure_ascii=False)
+            out.write("\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    if args.catalog_export:
+        print(f"[✓] Exported {len(rows)} {table} → {args.catalog_export}")
+
+# === Global cross-account shortcode index ===
+GLOBAL_INDEX_FILE = os.path.join(DOWNLOAD_ROOT, "shortcodes.sqlite")
+LINKED_POST_FILE = "linked-post.json"  # pointer left where a directory symlink cannot be created
+
+class GlobalShortcodeIndex:
+    """
+    Records the canonical directory of every post downloaded under DOWNLOAD_ROOT,
+    whichever account's session it was downloaded for, so other sessions can
+    link to it instead of scraping and downloading it again.
+    """
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS canonical_posts (
+        shortcode   TEXT PRIMARY KEY,
+        session     TEXT NOT NULL,
+        post_dir    TEXT NOT NULL,
+        url         TEXT,
+        recorded_at REAL
+    );
+    """
+
+    def __init__(self, db_path):
+        self.conn = sqlite3.connect(db_path, timeout=60)
+        self.conn.executescript(self.SCHEMA)
+
+    def lookup(self, shortcode):
+        """Returns (session, absolute post_dir) of the canonical copy, or None if unknown or gone from disk."""
+        row = self.conn.execute("SELECT session, post_dir FROM canonical_posts WHERE shortcode = ?", (shortcode,)).fetchone()
+        if not row:
+            return None
+        post_dir = os.path.join(DOWNLOAD_ROOT, row[1])
+        return (row[0], post_dir) if post_dir_has_media(post_dir) else None
+
+    def record(self, shortcode, session, post_dir, url):
+        """
+        Registers a post's canonical location once its media is on disk. The first
+        session to download a post keeps it, unless that copy has lost its media.
+        """
+        if self.lookup(shortcode):
+            return
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO canonical_posts VALUES (?, ?, ?, ?, ?)",
+                              (shortcode, session, os.path.relpath(post_dir, DOWNLOAD_ROOT), url, time.time()))
+
+    def close(self):
+        self.conn.close()
+
+def post_dir_has_media(post_dir):
+    """True if a post directory exists and holds at least one image or video file."""
+    try:
+        return any(entry.name.lower().endswith(MEDIA_EXTENSIONS) for entry in os.scandir(post_dir))
+    except OSError:
+        return False
+
+def record_in_global_index(global_index, post_url, media_items, post_dir, call_ytdlp):
+    """Makes this post's directory canonical, but only once all of its media has been downloaded."""
+    if post_media_on_disk(media_items, post_dir, call_ytdlp):
+        global_index.record(post_url.rstrip('/').split('/')[-1], SESSION_NAME, post_dir, post_url)
+
+def settle_video_posts(video_jobs, pending, cost_model, global_index):
+    """
+    Completes the bookkeeping of posts whose queued video job has finished: their time
+    (up to queueing plus the download) goes to the cost model and, if the job succeeded,
+    the post enters the global index. pending maps post URL ->
+    (media_items, post_dir, call_ytdlp, seconds spent before the video was queued).
+    """
+    for post_url, video_seconds, succeeded in video_jobs.take_finished():
+        entry = pending.pop(post_url, None)
+        if not entry:
+            continue
+        media_items, post_dir, call_ytdlp, seconds = entry
+        cost_model.observe(post_url, seconds + video_seconds, len(media_items), call_ytdlp)
+        catalog_update_video(post_dir, post_url.rstrip('/').split('/')[-1])
+        if succeeded and global_index:
+            record_in_global_index(global_index, post_url, media_items, post_dir, call_ytdlp)
+
+def link_post_dir(canonical_dir, session):
+    """
+    Makes a post downloaded for another session appear in this one: a directory
+    symlink where possible, otherwise a directory holding linked-post.json.
+    Returns the path created in this session.
+    """
+    link_path = os.path.join(DOWNLOAD_ROOT, session, os.path.basename(canonical_dir))
+    if os.path.lexists(link_path):
+        return link_path
+    try:
+        os.symlink(os.path.relpath(canonical_dir, os.path.dirname(link_path)), link_path, target_is_directory=True)
+    except (OSError, NotImplementedError):
+        os.makedirs(link_path, exist_ok=True)
+        with open(os.path.join(link_path, LINKED_POST_FILE), "w") as f:
+            json.dump({"canonical_dir": os.path.relpath(canonical_dir, DOWNLOAD_ROOT)}, f, indent=2)
+    return link_path
+
+def link_from_global_index(global_index, post_url):
+    """If another session already downloaded this post, links it here and returns True."""
+    shortcode = post_url.rstrip('/').split('/')[-1]
+    canonical = global_index.lookup(shortcode)
+    if not canonical or canonical[0] == SESSION_NAME:
+        return False
+    link_path = link_post_dir(canonical[1], SESSION_NAME)
+    tqdm.write(f"[↪] {post_url} already downloaded for {canonical[0]}, linked → {link_path}")
+    return True
+
+# === Multi-worker coordination ===
+class WorkCoordinator:
+    """
+    Leases posts to workers through a SQLite database on a shared volume, so
+    several containers can split one profile (or many profiles) without
+    processing a post twice. A lease expires unless the owning worker's
+    heartbeat thread renews it; expired leases are reclaimed by other workers,
+    and a post whose lease expired MAX_ATTEMPTS times is marked failed. The
+    same heartbeat keeps a profile scan alive in the sessions table, so other
+    workers wait for it instead of starting a second one.
+    """
+    MAX_ATTEMPTS = 3
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS work (
+        session       TEXT NOT NULL,
+        shortcode     TEXT NOT NULL,
+        url           TEXT NOT NULL,
+        position      INTEGER NOT NULL,
+        state         TEXT NOT NULL DEFAULT 'pending',
+        worker        TEXT,
+        lease_expires REAL,
+        attempts      INTEGER NOT NULL DEFAULT 0,
+        error         TEXT,
+        PRIMARY KEY (session, shortcode)
+    );
+    CREATE INDEX IF NOT EXISTS work_claim ON work (session, state, position);
+    CREATE TABLE IF NOT EXISTS sessions (
+        session       TEXT PRIMARY KEY,
+        state         TEXT NOT NULL,
+        worker        TEXT,
+        updated_at    REAL
+    );
+    """
+
+    def __init__(self, db_path, worker_id, lease_ttl):
+        self.db_path = db_path
+        self.worker_id = worker_id
+        self.lease_ttl = lease_ttl
+        self.conn = self._connect()
+        self.conn.executescript(self.SCHEMA)
+        self._stop = threading.Event()
+        self._heartbeat = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        self._heartbeat.start()
+
+    def _connect(self):
+        # Autocommit mode; writes use explicit BEGIN IMMEDIATE so claims are atomic across processes.
+        # The default rollback journal is kept (not WAL) because WAL needs shared memory on a single host.
+        return sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+
+    def _heartbeat_loop(self):
+        conn = self._connect()
+        try:
+            while not self._stop.wait(max(1, self.lease_ttl / 3)):
+                try:
+                    conn.execute("UPDATE work SET lease_expires = ? WHERE worker = ? AND state = 'leased'",
+                                 (time.time() + self.lease_ttl, self.worker_id))
+                    conn.execute("UPDATE sessions SET updated_at = ? WHERE worker = ? AND state = 'collecting'",
+                                 (time.time(), self.worker_id))
+                except sqlite3.Error as e:
+                    tqdm.write(f"[!] Coordinator heartbeat failed: {e}")
+        finally:
+            conn.close()
+
+    def start_collection(self, session):
+        """
+        Returns True if this worker should scan the profile and enqueue its posts.
+        Only one worker scans at a time; a scan that is still running (its heartbeat is younger
+        than the lease TTL) or finished less than a lease TTL ago is reused by the others.
+        """
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute("SELECT state, updated_at FROM sessions WHERE session = ?", (session,)).fetchone()
+            if row and row[1] and now - row[1] < self.lease_ttl:
+                self.conn.execute("COMMIT")
+                return False
+            self.conn.execute("INSERT OR REPLACE INTO sessions VALUES (?, 'collecting', ?, ?)", (session, self.worker_id, now))
+            self.conn.execute("COMMIT")
+            return True
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def enqueue(self, session, urls):
+        """Adds posts (in processing order) that are not already known, then marks the session ready."""
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            start = self.conn.execute("SELECT COALESCE(MAX(position) + 1, 0) FROM work WHERE session = ?", (session,)).fetchone()[0]
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO work (session, shortcode, url, position) VALUES (?, ?, ?, ?)",
+                [(session, url.rstrip('/').split('/')[-1], url, start + i) for i, url in enumerate(urls)],
+            )
+            self.conn.execute("INSERT OR REPLACE INTO sessions VALUES (?, 'ready', ?, ?)", (session, self.worker_id, time.time()))
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        tqdm.write(f"[i] Coordinator: enqueued {len(urls)} posts for {session}")
+
+    def claim(self, session):
+        """Leases the next pending (or expired) post for this worker. Returns its URL, or None if nothing is left."""
+        while True:
+            now = time.time()
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(
+                    "SELECT shortcode, url, state, worker, attempts FROM work WHERE session = ? "
+                    "AND (state = 'pending' OR (state = 'leased' AND lease_expires < ?)) ORDER BY position LIMIT 1",
+                    (session, now),
+                ).fetchone()
+                if row is None:
+                    self.conn.execute("COMMIT")
+                    return None
+                shortcode, url, state, previous_worker, attempts = row
+                if state == "leased" and attempts >= self.MAX_ATTEMPTS:
+                    self.conn.execute("UPDATE work SET state = 'failed', error = 'lease expired too often' WHERE session = ? AND shortcode = ?",
+                                      (session, shortcode))
+                    self.conn.execute("COMMIT")
+                    tqdm.write(f"[!] Coordinator: giving up on {url} after {attempts} expired leases")
+                    continue
+                self.conn.execute(
+                    "UPDATE work SET state = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE session = ? AND shortcode = ?",
+                    (self.worker_id, now + self.lease_ttl, session, shortcode),
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+            if state == "leased":
+                tqdm.write(f"[i] Coordinator: reclaimed {url} from expired worker {previous_worker}")
+            return url
+
+    def iter_claims(self, session, poll_interval=5):
+        """
+        Yields leased post URLs until the session's queue is drained, waiting while another
+        worker is still scanning (until its heartbeat goes stale for a lease TTL).
+        """
+        while True:
+            url = self.claim(session)
+            if url:
+                yield url
+                continue
+            row = self.conn.execute("SELECT state, updated_at FROM sessions WHERE session = ?", (session,)).fetchone()
+            if row and row[0] == "collecting" and time.time() - row[1] < self.lease_ttl:
+                time.sleep(poll_interval)
+                continue
+            return
+
+    def claim_compaction(self, session):
+        """
+        Returns True for exactly one worker once the session's queue is drained, so that
+        worker compacts the shared processed index (workers never compact it on their own).
+        """
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            busy = self.conn.execute("SELECT 1 FROM work WHERE session = ? AND state IN ('pending', 'leased') LIMIT 1",
+                                     (session,)).fetchone()
+            claimed = not busy and self.conn.execute(
+                "UPDATE sessions SET state = 'compacted', worker = ? WHERE session = ? AND state = 'ready'",
+                (self.worker_id, session),
+            ).rowcount == 1
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return claimed
+
+    def _finish(self, session, url, state, error=None):
+        self.conn.execute("UPDATE work SET state = ?, error = ?, lease_expires = NULL WHERE session = ? AND shortcode = ? AND worker = ?",
+                          (state, error, session, url.rstrip('/').split('/')[-1], self.worker_id))
+
+    def complete(self, session, url):
+        self._finish(session, url, "done")
+
+    def fail(self, session, url, error):
+        self._finish(session, url, "failed", str(error))
+
+    def release(self, session, url):
+        """Returns a leased post to the queue without counting it as an attempt."""
+        self.conn.execute("UPDATE work SET state = 'pending', worker = NULL, lease_expires = NULL, attempts = attempts - 1 "
+                          "WHERE session = ? AND shortcode = ? AND worker = ?",
+                          (session, url.rstrip('/').split('/')[-1], self.worker_id))
+
+    def close(self):
+        self._stop.set()
+        self._heartbeat.join()
+        self.conn.close()
+
+# === Run budget and post prioritization ===
+POST_TIMINGS_FILE = "post-timings.json"
+PRIORITY_DESCRIPTIONS = {
+    "oldest": "Oldest to Newest",
+    "newest": "Newest to Oldest",
+    "video-last": "Newest First, Reels Last",
+    "smallest-first": "Cheapest First",
+}
+
+def post_kind(url):
+    return "reel" if "/reel/" in url else "p"
+
+class PostCostModel:
+    """
+    Estimates how long a post takes to process from past runs of the same session,
+    persisted in <session>/post-timings.json. Each post's media count is recorded
+    when it is extracted and its measured time when it completes (including a
+    queued video download), so retries and re-runs of known posts use their own
+    figures. Posts never extracted fall back to exponentially weighted moving
+    averages per post kind (/p/ vs /reel/).
+    """
+    ALPHA = 0.3
+    # "p"/"reel": seconds per post; "image": seconds per image; "video": extra seconds for a post's video
+    PRIORS = {"p": 10.0, "reel": 30.0, "image": 3.0, "video": 20.0}
+
+    def __init__(self, path):
+        self.path = path
+        self.estimates = dict(self.PRIORS)
+        self.samples = {key: 0 for key in self.PRIORS}
+        self.posts = {}  # shortcode -> {"media": images, "video": bool, "seconds": measured time or None}
+        self.updated = False
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+                self.estimates.update(data.get("estimates", {}))
+                self.samples.update(data.get("samples", {}))
+                self.posts.update(data.get("posts", {}))
+            except (OSError, ValueError):
+                tqdm.write(f"[*] Warning: Could not read {path}. Starting from default post timings.")
+
+    def _average(self, key, value):
+        # The first real measurement replaces the prior outright
+        if self.samples[key]:
+            self.estimates[key] = self.ALPHA * value + (1 - self.ALPHA) * self.estimates[key]
+        else:
+            self.estimates[key] = value
+        self.samples[key] += 1
+
+    def estimate(self, url):
+        post = self.posts.get(url.rstrip('/').split('/')[-1])
+        if not post:
+            return self.estimates[post_kind(url)]
+        if post.get("seconds") is not None:
+            return post["seconds"]
+        return post["media"] * self.estimates["image"] + (self.estimates["video"] if post["video"] else 0)
+
+    def has_video(self, url):
+        """Whether the post is known to contain video; unextracted posts are judged by their URL kind."""
+        post = self.posts.get(url.rstrip('/').split('/')[-1])
+        return post["video"] if post else post_kind(url) == "reel"
+
+    def note_extracted(self, url, media_count, has_video):
+        """Records what an extraction found, so a later retry of the post can be estimated before it completes."""
+        shortcode = url.rstrip('/').split('/')[-1]
+        self.posts[shortcode] = {"media": media_count, "video": bool(has_video),
+                                 "seconds": self.posts.get(shortcode, {}).get("seconds")}
+        self.updated = True
+
+    def observe(self, url, seconds, media_count, has_video):
+        """Records the measured time of a completed post and folds it into the averages."""
+        self._average(post_kind(url), seconds)
+        if has_video:
+            self._average("video", max(0.0, seconds - media_count * self.estimates["image"]))
+        elif media_count:
+            self._average("image", seconds / media_count)
+        self.posts[url.rstrip('/').split('/')[-1]] = {"media": media_count, "video": bool(has_video), "seconds": round(seconds, 2)}
+        self.updated = True
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"estimates": self.estimates, "samples": self.samples, "posts": self.posts}, f)
+        os.replace(tmp_path, self.path)
+
+def prioritize_posts(urls, policy, cost_model):
+    """Orders pending post URLs (given oldest to newest) for processing under a --priority policy."""
+    if policy == "oldest":
+        return list(urls)
+    newest_first = list(reversed(urls))
+    # sorted() is stable, so every policy below keeps newest-first order between equals
+    if policy == "video-last":
+        return sorted(newest_first, key=cost_model.has_video)
+    if policy == "smallest-first":
+        return sorted(newest_first, key=cost_model.estimate)
+    return newest_first
+
+class RunBudget:
+    """
+    Tracks the --max-runtime deadline of one run. A post is only started if its
+    estimated cost still fits; the rest are deferred and stay unprocessed, so the
+    next run picks them up again.
+    """
+
+    def __init__(self, seconds, cost_model):
+        self.deadline = time.monotonic() + seconds if seconds else None
+        self.cost_model = cost_model
+        self.deferred = []
+
+    def remaining(self):
+        return float("inf") if self.deadline is None else self.deadline - time.monotonic()
+
+    def fits(self, url):
+        return self.remaining() >= self.cost_model.estimate(url)
+
+    def defer(self, url):
+        self.deferred.append(url)
+
+    def write_deferred(self, path):
+        with open(path, "w") as f:
+            for url in self.deferred:
+                f.write(url + "\n")
+        tqdm.write(f"[!] --max-runtime budget reached: deferred {len(self.deferred)} posts to the next run → {path}")
+
+# === Job server (--serve) ===
+JOB_TYPES = ("post", "profile", "stories", "retry")
+# Per-job overrides a client may pass in "options"
+JOB_OPTIONS = ("max_scraped_posts", "max_grabbed_posts", "overwrite", "no_retry_errors", "no_resume",
+               "extraction_backend", "global_index", "video_workers", "max_runtime", "priority", "tabs")
+# Their command line definitions, so job options are checked like the flags they override
+JOB_OPTION_ACTIONS = {action.dest: action for action in parser._actions if action.dest in JOB_OPTIONS}
+# Every args attribute a job may change; reset to the worker's command line values before each job
+JOB_ARG_NAMES = ("username", "post_id", "download_stories", "skip_posts", "retry_errors_only",
+                 "cleanup_and_retry", "verify") + JOB_OPTIONS
+SERVE_ONLY_FLAGS = ("--serve",)
+SERVE_ONLY_OPTIONS = ("--serve-host", "--serve-port", "--serve-browsers", "--serve-max-queue", "--worker-id")
+
+def worker_command(slot):
+    """
+    Command line for a --serve-worker: this script with our own arguments minus the
+    server-only ones. Each worker gets its own --worker-id so coordinator leases stay apart.
+    """
+    argv = []
+    skip_value = False
+    for arg in sys.argv[1:]:
+        if skip_value:
+            skip_value = False
+            continue
+        name = arg.split("=", 1)[0]
+        if name in SERVE_ONLY_FLAGS:
+            continue
+        if name in SERVE_ONLY_OPTIONS:
+            skip_value = "=" not in arg
+            continue
+        argv.append(arg)
+    if args.worker_id:
+        argv += ["--worker-id", f"{args.worker_id}-{slot}"]
+    return [sys.executable, os.path.abspath(__file__), "--serve-worker"] + argv
+
+def check_job_option(name, value):
+    """Validates one job option against its argparse definition and returns the value args would hold."""
+    action = JOB_OPTION_ACTIONS[name]
+    if action.nargs == 0:
+        # store_true flags
+        if not isinstance(value, bool):
+            raise ValueError(f"option {name} must be true or false")
+        return value
+    if value is None and action.default is None:
+        return None
+    expected = action.type or str
+    if isinstance(value, bool) or not isinstance(value, (str, expected)):
+        raise ValueError(f"option {name} must be {'an integer' if expected is int else 'a string'}")
+    try:
+        value = expected(value)
+    except ValueError:
+        raise ValueError(f"option {name} must be {'an integer' if expected is int else 'a string'}, got {value!r}")
+    if action.choices and value not in action.choices:
+        raise ValueError(f"option {name} must be one of {', '.join(action.choices)}")
+    return value
+
+def apply_job_args(job, defaults):
+    """Points args (and the session globals) at one job."""
+    for name, value in defaults.items():
+        setattr(args, name, value)
+    for name, value in (job.get("options") or {}).items():
+        if name in JOB_OPTIONS:
+            setattr(args, name, value)
+    job_type = job["type"]
+    args.username = job.get("username") or args.username
+    args.post_id = job.get("post_id") if job_type == "post" else None
+    args.download_stories = job_type == "stories"
+    args.skip_posts = job_type == "stories"
+    args.retry_errors_only = job_type == "retry"
+    args.cleanup_and_retry = False
+    args.verify = False
+    configure_session()
+
+def serve_worker():
+    """
+    Internal --serve-worker loop: keeps this process's browser warm and runs one
+    JSON job per stdin line, answering with one JSON result line on the original
+    stdout (serve_results); all other output goes to stderr.
+    """
+    defaults = {name: getattr(args, name) for name in JOB_ARG_NAMES}
+
+    def reply(message):
+        serve_results.write(json.dumps(message) + "\n")
+        serve_results.flush()
+
+    reply({"ready": True, "pid": os.getpid()})
+    for line in sys.stdin:
+        job = json.loads(line)
+        started = time.monotonic()
+        media_before = dict(MEDIA_STATS)
+        try:
+            apply_job_args(job, defaults)
+            # Firefox may have died while the worker sat idle
+            ensure_driver_healthy()
+            run()
+            result = {"id": job["id"], "status": "done"}
+        except Exception as e:
+            tqdm.write(f"[!!!] Job {job['id']} failed: {e}")
+            result = {"id": job["id"], "status": "failed", "error": str(e)}
+        result["duration"] = round(time.monotonic() - started, 2)
+        result["media"] = {key: MEDIA_STATS[key] - media_before[key] for key in MEDIA_STATS}
+        reply(result)
+
+class JobServer:
+    """
+    Queues jobs and dispatches them to --serve-browsers warm worker processes, one
+    job per worker at a time. Jobs for the same session (username, or post ID for
+    post jobs) never run concurrently, since they share its processed index and logs.
+    """
+
+    def __init__(self, browsers, max_queue):
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.pending = deque()
+        self.max_queue = max_queue
+        self.active_sessions = set()
+        self.stopping = False
+        self.ids = itertools.count(1)
+        self.dispatchers = [threading.Thread(target=self._dispatch, args=(slot,), daemon=True) for slot in range(browsers)]
+        for thread in self.dispatchers:
+            thread.start()
+
+    def submit(self, spec):
+        """Validates and queues a job spec. Raises ValueError for bad specs and queue.Full when the queue is full."""
+        job_type = spec.get("type")
+        if job_type not in JOB_TYPES:
+            raise ValueError(f"type must be one of {', '.join(JOB_TYPES)}")
+        if job_type == "post" and not spec.get("post_id"):
+            raise ValueError("post jobs need a post_id")
+        if job_type != "post" and not (spec.get("username") or args.username):
+            raise ValueError(f"{job_type} jobs need a username")
+        options = spec.get("options") or {}
+        if not isinstance(options, dict):
+            raise ValueError("options must be an object")
+        unknown = set(options) - set(JOB_OPTIONS)
+        if unknown:
+            raise ValueError(f"unsupported options: {', '.join(sorted(unknown))}")
+        options = {name: check_job_option(name, value) for name, value in options.items()}
+        with self.changed:
+            if len(self.pending) >= self.max_queue:
+                raise queue.Full
+            job = {
+                "id": next(self.ids),
+                "type": job_type,
+                "username": spec.get("username"),
+                "post_id": spec.get("post_id"),
+                "options": options,
+                "status": "queued",
+                "submitted_at": time.time(),
+            }
+            self.pending.append(job)
+            self.jobs[job["id"]] = job
+            self.changed.notify_all()
+        return dict(job)
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def summary(self):
+        with self.lock:
+            counts = {}
+            for job in self.jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+            return {"workers": len(self.dispatchers), "queued": len(self.pending), "counts": counts,
+                    "jobs": [dict(job) for job in list(self.jobs.values())[-50:]]}
+
+    @staticmethod
+    def job_session(job):
+        """The session directory a job works in, as configure_session() would name it."""
+        return job["post_id"] if job["type"] == "post" else (job["username"] or args.username)
+
+    def _next_job(self, slot):
+        """Blocks until a queued job whose session is idle is available (returned as running), or None on shutdown."""
+        with self.changed:
+            while not self.stopping:
+                for job in self.pending:
+                    session = self.job_session(job)
+                    if session not in self.active_sessions:
+                        self.pending.remove(job)
+                        self.active_sessions.add(session)
+                        job.update(status="running", worker=slot, started_at=time.time())
+                        return job
+                self.changed.wait()
+            return None
+
+    def _finish(self, job, **fields):
+        with self.changed:
+            job.update(finished_at=time.time(), **fields)
+            self.active_sessions.discard(self.job_session(job))
+            self.changed.notify_all()
+
+    def _spawn_worker(self, slot):
+        proc = subprocess.Popen(worker_command(slot), stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1)
+        try:
+            ready = json.loads(proc.stdout.readline() or "null")
+            if not (isinstance(ready, dict) and ready.get("ready")):
+                raise ValueError(f"unexpected startup message {ready!r}")
+        except ValueError as e:
+            self._stop_worker(proc)
+            raise RuntimeError(f"worker {slot} failed to start (code {proc.returncode}): {e}")
+        tqdm.write(f"[✓] Browser worker {slot} ready (pid {ready['pid']})")
+        return proc
+
+    @staticmethod
+    def _stop_worker(proc):
+        """Terminates a worker that died or broke its protocol, so a fresh one can be spawned."""
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+
+    def _run_job(self, proc, job):
+        """Sends one job to a worker and returns its result, or raises if the worker died or answered garbage."""
+        proc.stdin.write(json.dumps(job) + "\n")
+        proc.stdin.flush()
+        line = proc.stdout.readline()
+        if not line:
+            raise RuntimeError("browser worker exited")
+        try:
+            result = json.loads(line)
+            return {"status": result["status"], "error": result.get("error"),
+                    "duration": result["duration"], "media": result["media"]}
+        except (ValueError, KeyError, TypeError):
+            raise RuntimeError(f"invalid response from browser worker: {line.strip()[:200]}")
+
+    def _dispatch(self, slot):
+        proc = None
+        while True:
+            # A worker that died during shutdown is not replaced only to be closed again
+            if (proc is None or proc.poll() is not None) and not self.stopping:
+                try:
+                    proc = self._spawn_worker(slot)
+                except Exception as e:
+                    tqdm.write(f"[!] Could not start browser worker {slot}: {e}")
+                    proc = None
+            job = self._next_job(slot)
+            if job is None:
+                break
+            if proc is None:
+                self._finish(job, status="failed", error="browser worker unavailable")
+                continue
+            try:
+                self._finish(job, **self._run_job(proc, job))
+            except Exception as e:
+                tqdm.write(f"[!] Browser worker {slot} failed on job {job['id']}, restarting it: {e}")
+                self._finish(job, status="failed", error=str(e))
+                self._stop_worker(proc)
+                proc = None
+        if proc is not None:
+            proc.stdin.close()
+            proc.wait()
+
+    def shutdown(self):
+        """Lets running jobs finish, drops queued ones and stops the workers."""
+        with self.changed:
+            self.stopping = True
+            for job in self.pending:
+                job["status"] = "cancelled"
+            self.pending.clear()
+            self.changed.notify_all()
+        for thread in self.dispatchers:
+            thread.join()
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /jobs        {"type": "post|profile|stories|retry", "username": ..., "post_id": ..., "options": {...}}
+    GET  /jobs        queue summary and recent jobs
+    GET  /jobs/<id>   one job's status
+    POST /shutdown    stop the server after running jobs finish
+    """
+
+    def _reply(self, code, body):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        if parts == ["jobs"]:
+            self._reply(200, self.server.job_server.summary())
+        elif len(parts) == 2 and parts[0] == "jobs" and parts[1].isdigit():
+            job = self.server.job_server.get(int(parts[1]))
+            self._reply(200, job) if job else self._reply(404, {"error": "no such job"})
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path.rstrip("/") == "/shutdown":
+            self._reply(202, {"status": "shutting down"})
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+            return
+        if self.path.rstrip("/") != "/jobs":
+            self._reply(404, {"error": "not found"})
+            return
+        try:
+            spec = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            self._reply(202, self.server.job_server.submit(spec))
+        except (ValueError, AttributeError) as e:
+            self._reply(400, {"error": str(e)})
+        except queue.Full:
+            self._reply(503, {"error": "job queue is full"})
+
+    def log_message(self, format, *log_args):
+        tqdm.write(f"[i] {self.address_string()} {format % log_args}")
+
+def serve():
+    """Runs the --serve job server until interrupted or POST /shutdown."""
+    job_server = JobServer(args.serve_browsers, args.serve_max_queue)
+    httpd = ThreadingHTTPServer((args.serve_host, args.serve_port), JobRequestHandler)
+    httpd.job_server = job_server
+    print(f"[*] Job server listening on http://{args.serve_host}:{args.serve_port} with {args.serve_browsers} browser worker(s)")
+    try:
+        httpd.serve_forever()
+    finally:
+        httpd.server_close()
+        print("[*] Stopping job server, waiting for running jobs...")
+        job_server.shutdown()
+
 # === Main Execution ===
 def main():
     try:
+        if args.serve:
+            serve()
+        elif args.serve_worker:
+            serve_worker()
+        else:
+            run()
+    except KeyboardInterrupt:
+        print("[!] Interrupted by user - please wait for clean exit...")
+    finally:
+        report_media_stats()
+        report_driver_stats()
+        report_extract_cache_stats()
+        if driver:
+            driver.quit()
+            print("[✓] Browser closed.")
+
+def run():
+    """Runs one session for the current args: a whole CLI invocation, or a single --serve job."""
+    global tab_pool
+    video_jobs = None
+    coordinator = None
+    cost_model = None
+    budget = None
+    global_index = GlobalShortcodeIndex(GLOBAL_INDEX_FILE) if args.global_index and not OFFLINE_MODE else None
+    try:
+        if OFFLINE_MODE:
+            if args.catalog_rebuild:
+                rebuild_catalog()
+            if args.catalog_query:
+                query_catalog()
+            return
+        cost_model = PostCostModel(os.path.join(DOWNLOAD_ROOT, SESSION_NAME, POST_TIMINGS_FILE))
+        budget = RunBudget(args.max_runtime, cost_model)
         if getattr(args, "cleanup_and_retry", False):
             cleanup_and_retry_empty_dirs()
             return
+        if getattr(args, "verify", False):
+            verify_archive()
+            if not args.no_retry_errors:
+                # Retry this session's corrupt posts (other sessions are retried on their next run)
+                error_log_pattern = os.path.join(DOWNLOAD_ROOT, SESSION_NAME, f"*-errors_*{WORKER_TAG}.log")
+                error_logs = glob.glob(error_log_pattern)
+                error_logs = list(set(error_logs + [ERROR_LOG]))
+                retry_failed_posts(error_logs, budget)
+            return
         # Download stories if requested
         if getattr(args, "download_stories", False):
             download_stories(args.username)
@@ -447,30 +2543,50 @@ def main():
             return
         if args.retry_errors_only:
             # Only retry failed posts from error logs, then exit
-            error_log_pattern = os.path.join(DOWNLOAD_ROOT, SESSION_NAME, "*-errors_*.log")
+            error_log_pattern = os.path.join(DOWNLOAD_ROOT, SESSION_NAME, f"*-errors_*{WORKER_TAG}.log")
             error_logs = glob.glob(error_log_pattern)
             error_logs = list(set(error_logs + [ERROR_LOG]))
-            retry_failed_posts(error_logs)
+            retry_failed_posts(error_logs, budget)
             return  # Exit after retrying errors
 
         if POST_URL:
             # If a specific post ID is provided, just scrape that one
-            items, dir_path, call_ytdlp = extract_media_urls(POST_URL)
-            download_images(items, dir_path)
-            if call_ytdlp:
+            if not (global_index and link_from_global_index(global_index, POST_URL)):
+                items, dir_path, call_ytdlp = extract_post(POST_URL)
+                download_images(items, dir_path)
                 shortcode = POST_URL.rstrip('/').split('/')[-1]
-                download_video(POST_URL, dir_path, shortcode)
+                if call_ytdlp:
+                    download_video(POST_URL, dir_path, shortcode)
+                if global_index:
+                    record_in_global_index(global_index, POST_URL, items, dir_path, call_ytdlp)
             processed_urls = load_processed_urls(PROCESSED_URLS_FILE)
             processed_urls.add(POST_URL)
             save_processed_urls(PROCESSED_URLS_FILE, processed_urls)
         else:
             # Init total_urls_grabbed counter
             total_urls_grabbed = 0
-            # Scrape all post links from the profile (most recent to oldest)
-            post_links = collect_post_links()
+            # Hand videos to a parallel executor if requested, otherwise download them inline
+            if args.video_workers > 1:
+                video_jobs = VideoJobExecutor(args.video_workers)
+            # Posts whose video job is still running are timed, and indexed, once it finishes
+            pending_video_posts = {}
+            # With a shared coordinator, only one worker scans the profile and the rest join its queue
+            collected = True
+            if args.coordinator_db:
+                coordinator = WorkCoordinator(os.path.abspath(args.coordinator_db), WORKER_ID, args.lease_ttl)
+                collected = coordinator.start_collection(SESSION_NAME)
+            if collected:
+                # Scrape all post links from the profile (most recent to oldest)
+                post_links = collect_post_links()
+            else:
+                tqdm.write(f"[i] Coordinator: {SESSION_NAME} was scanned recently by another worker, joining its queue.")
+                post_links = []
             
             # Load previously processed URLs for robust deduplication
             processed_urls = load_processed_urls(PROCESSED_URLS_FILE)
+            if coordinator:
+                # Other workers append to the same journal; the last one to finish compacts it
+                processed_urls.auto_compact = False
 
             # Reverse the list so it goes from oldest to most recent
             # This modification is applied before calculating the resume index
@@ -501,44 +2617,125 @@ def main():
                 tqdm.write("[*] Resume file not found. Starting from the oldest available.")
 
 
-            # Iterate through the collected links starting from the resume point
-            # The list is already reversed, so this will process from oldest to newest
-            for link_to_process in tqdm(post_links[resume_index:], desc="Processing Posts (Oldest to Newest)"):
+            # Posts after the resume point, ordered by the --priority policy (oldest to newest by default)
+            work = prioritize_posts(post_links[resume_index:], args.priority, cost_model)
+            if coordinator:
+                if collected:
+                    coordinator.enqueue(SESSION_NAME, [url for url in work if url not in processed_urls])
+                # Posts are now handed out one lease at a time, in the same priority order
+                work = coordinator.iter_claims(SESSION_NAME)
+            total_posts = len(work) if isinstance(work, list) else None
+            # With --tabs, the next posts are pulled (and leased) early so they can load in background tabs
+            if args.tabs > 1 and args.extraction_backend == "selenium":
+                tab_pool = TabPool(args.tabs)
+                work = Lookahead(work, args.tabs - 1)
+
+            for link_to_process in tqdm(work, total=total_posts, desc=f"Processing Posts ({PRIORITY_DESCRIPTIONS[args.priority]})"):
+                if pending_video_posts:
+                    settle_video_posts(video_jobs, pending_video_posts, cost_model, global_index)
                 if link_to_process in processed_urls:
                     tqdm.write(f"[⏩] Skipping already processed: {link_to_process}")
+                    if coordinator:
+                        coordinator.complete(SESSION_NAME, link_to_process)
                     continue # Skip this URL if it's already in our processed set
+                # Collabs/reposts already downloaded for another account are linked, not re-downloaded
+                if global_index and link_from_global_index(global_index, link_to_process):
+                    processed_urls.add(link_to_process)
+                    save_processed_urls(PROCESSED_URLS_FILE, processed_urls)
+                    if coordinator:
+                        coordinator.complete(SESSION_NAME, link_to_process)
+                    continue
+                # Posts that no longer fit --max-runtime stay unprocessed for the next run
+                if not budget.fits(link_to_process):
+                    budget.defer(link_to_process)
+                    if coordinator:
+                        # The queue would hand the same post straight back, so leave the rest to other workers
+                        coordinator.release(SESSION_NAME, link_to_process)
+                        break
+                    continue
                 total_urls_grabbed += 1
                 
                 # Stop at --max-grabbed-posts if specified
                 if MAX_GRABBED_POSTS:
                     if total_urls_grabbed > MAX_GRABBED_POSTS :
                         tqdm.write(f"[!] Reached maximum number of grabbed posts ({MAX_GRABBED_POSTS}), exiting.")
+                        if coordinator:
+                            coordinator.release(SESSION_NAME, link_to_process)
                         break
 
+                if tab_pool:
+                    try:
+                        tab_pool.prefetch(link_to_process, tab_prefetch_candidates(work.upcoming(), processed_urls))
+                    except WebDriverException as e:
+                        tqdm.write(f"[!] Could not preload upcoming posts: {e}")
                 try:
-                    items, dir_path, call_ytdlp = extract_media_urls(link_to_process)
+                    post_started = time.monotonic()
+                    items, dir_path, call_ytdlp = extract_post(link_to_process)
+                    cost_model.note_extracted(link_to_process, len(items), call_ytdlp)
                     download_images(items, dir_path)
+                    shortcode = link_to_process.rstrip('/').split('/')[-1]
+                    video_queued = False
                     if call_ytdlp:
-                        shortcode = link_to_process.rstrip('/').split('/')[-1]
-                        download_video(link_to_process, dir_path, shortcode)
+                        if video_jobs:
+                            video_queued = video_jobs.submit(link_to_process, dir_path, shortcode)
+                        else:
+                            download_video(link_to_process, dir_path, shortcode)
+                    if video_queued:
+                        pending_video_posts[link_to_process] = (items, dir_path, call_ytdlp, time.monotonic() - post_started)
+                    else:
+                        cost_model.observe(link_to_process, time.monotonic() - post_started, len(items), call_ytdlp)
+                        if global_index:
+                            record_in_global_index(global_index, link_to_process, items, dir_path, call_ytdlp)
                     processed_urls.add(link_to_process)
                     save_processed_urls(PROCESSED_URLS_FILE, processed_urls)
+                    if coordinator:
+                        coordinator.complete(SESSION_NAME, link_to_process)
                 except Exception as e:
                     tqdm.write(f"[!!!] Error processing {link_to_process}: {e}")
                     with open(ERROR_LOG, "a") as elog:
                         elog.write(f"{link_to_process} — main loop error: {e}\n")
+                    if coordinator:
+                        coordinator.fail(SESSION_NAME, link_to_process, e)
+            if coordinator and tab_pool:
+                # Posts leased ahead for preloading but never started go back to the queue
+                for url in work.buffer:
+                    coordinator.release(SESSION_NAME, url)
+            # Failed video jobs land in ERROR_LOG, so finish them before retrying errors
+            if video_jobs:
+                video_jobs.wait()
+                if pending_video_posts:
+                    settle_video_posts(video_jobs, pending_video_posts, cost_model, global_index)
+            if coordinator and coordinator.claim_compaction(SESSION_NAME):
+                tqdm.write(f"[i] Coordinator: queue for {SESSION_NAME} drained, compacting {processed_urls.index_path}")
+                save_processed_urls(PROCESSED_URLS_FILE, processed_urls)
+                try:
+                    processed_urls.compact()
+                except OSError as e:
+                    tqdm.write(f"[!] Could not compact {processed_urls.index_path}: {e}")
+            if budget.deferred:
+                budget.write_deferred(os.path.join(DOWNLOAD_ROOT, SESSION_NAME, f"{SESSION_NAME}-deferred_{timestamp_now}{WORKER_TAG}.log"))
         if not args.no_retry_errors:
             # Find all error logs for this session/user
-            error_log_pattern = os.path.join(DOWNLOAD_ROOT, SESSION_NAME, "*-errors_*.log")
+            error_log_pattern = os.path.join(DOWNLOAD_ROOT, SESSION_NAME, f"*-errors_*{WORKER_TAG}.log")
             error_logs = glob.glob(error_log_pattern)
             # Always include the current ERROR_LOG in case it's not matched (avoid duplicates with set)
             error_logs = list(set(error_logs + [ERROR_LOG]))
-            retry_failed_posts(error_logs)
-    except KeyboardInterrupt:
-        print("[!] Interrupted by user - please wait for clean exit...")
+            retry_failed_posts(error_logs, budget)
     finally:
-        driver.quit()
-        print("[✓] Browser closed.")
+        if video_jobs:
+            video_jobs.close()
+        if cost_model and cost_model.updated:
+            cost_model.save()
+        if tab_pool:
+            try:
+                tab_pool.close()
+            except WebDriverException:
+                pass
+            tab_pool = None
+        if coordinator:
+            coordinator.close()
+        if global_index:
+            global_index.close()
 
 def extract_urls_from_error_log(error_log_path):
     """Extracts Instagram post URLs from an error log file."""
@@ -553,9 +2750,11 @@ def extract_urls_from_error_log(error_log_path):
                 urls.add(match.group(1))
     return urls
 
-def retry_failed_posts(error_log_paths):
+def retry_failed_posts(error_log_paths, budget=None):
     """Retry posts that failed in previous runs, based only on error logs.
     If a post is successfully processed (all media skipped or downloaded), it is not included in the new error log.
+    With a RunBudget, the cheapest posts (by their recorded timings) are retried first, and posts that no
+    longer fit --max-runtime stay in the new error log for the next run.
     """
     all_failed_urls = set()
     for log_path in error_log_paths:
@@ -566,30 +2765,19 @@ def retry_failed_posts(error_log_paths):
 
     tqdm.write(f"[!] Retrying {len(all_failed_urls)} failed posts from error logs...")
     still_failed_urls = set()
-    for url in tqdm(all_failed_urls, desc="Retrying Failed Posts"):
+    deferred_urls = set()
+    retry_order = sorted(all_failed_urls, key=budget.cost_model.estimate) if budget else all_failed_urls
+    for url in tqdm(retry_order, desc="Retrying Failed Posts"):
+        if budget and not budget.fits(url):
+            deferred_urls.add(url)
+            continue
         try:
-            items, dir_path, call_ytdlp = extract_media_urls(url)
-            # Track if any image/video actually needed to be downloaded
-            all_exist = True
-            for media_url, label in items:
-                parsed_url = urllib.parse.urlparse(media_url)
-                original_filename = os.path.basename(parsed_url.path)
-                if not original_filename:
-                    ext = os.path.splitext(parsed_url.path)[-1]
-                    original_filename = f"media{ext if ext else '.jpg'}"
-                filename = f"{label}_{original_filename}"
-                filepath = os.path.join(dir_path, sanitize_filename(filename))
-                if not os.path.exists(filepath):
-                    all_exist = False
-                    break
-            # For video, check if any video file exists
-            video_exists = False
-            if call_ytdlp:
-                video_files = [f for f in os.listdir(dir_path) if f.endswith(('.mp4', '.webm', '.mkv'))]
-                if video_files:
-                    video_exists = True
+            retry_started = time.monotonic()
+            items, dir_path, call_ytdlp = extract_post(url)
+            if budget:
+                budget.cost_model.note_extracted(url, len(items), call_ytdlp)
             # If all images and (if needed) video exist, consider this post as successfully processed
-            if (items and all_exist) and (not call_ytdlp or video_exists):
+            if items and post_media_on_disk(items, dir_path, call_ytdlp):
                 tqdm.write(f"[✓] All media already present for {url}, removing from error log.")
                 continue
             # Otherwise, try to download missing media
@@ -603,30 +2791,18 @@ def retry_failed_posts(error_log_paths):
                 still_failed_urls.add(url)
                 continue
             # After download attempt, check again if all media exist
-            all_exist = True
-            for media_url, label in items:
-                parsed_url = urllib.parse.urlparse(media_url)
-                original_filename = os.path.basename(parsed_url.path)
-                if not original_filename:
-                    ext = os.path.splitext(parsed_url.path)[-1]
-                    original_filename = f"media{ext if ext else '.jpg'}"
-                filename = f"{label}_{original_filename}"
-                filepath = os.path.join(dir_path, sanitize_filename(filename))
-                if not os.path.exists(filepath):
-                    all_exist = False
-                    break
-            video_exists = False
-            if call_ytdlp:
-                video_files = [f for f in os.listdir(dir_path) if f.endswith(('.mp4', '.webm', '.mkv'))]
-                if video_files:
-                    video_exists = True
-            if (items and all_exist) and (not call_ytdlp or video_exists):
+            if items and post_media_on_disk(items, dir_path, call_ytdlp):
                 tqdm.write(f"[✓] Successfully retried {url}")
+                if budget:
+                    budget.cost_model.observe(url, time.monotonic() - retry_started, len(items), call_ytdlp)
             else:
                 still_failed_urls.add(url)
         except Exception as e:
             tqdm.write(f"[!!!] Error retrying {url}: {e}")
             still_failed_urls.add(url)
+    # A cached extraction that still failed to download is not worth replaying on the next retry
+    for url in still_failed_urls:
+        extract_cache_drop(url)
 
     # Remove all old error logs
     for log_path in error_log_paths:
@@ -635,13 +2811,17 @@ def retry_failed_posts(error_log_paths):
         except Exception:
             pass
 
-    # Write new error log with only remaining failed URLs
-    if still_failed_urls:
-        new_error_log = os.path.join(DOWNLOAD_ROOT, SESSION_NAME, f"{SESSION_NAME}-errors_remaining_{timestamp_now}.log")
+    # Write new error log with only remaining failed (or deferred) URLs
+    if still_failed_urls or deferred_urls:
+        new_error_log = os.path.join(DOWNLOAD_ROOT, SESSION_NAME, f"{SESSION_NAME}-errors_remaining_{timestamp_now}{WORKER_TAG}.log")
         
         with open(new_error_log, "w") as elog:
             for url in still_failed_urls:
                 elog.write(f"{url} — still failed after retry\n")
+            for url in deferred_urls:
+                elog.write(f"{url} — retry deferred by --max-runtime\n")
+        if deferred_urls:
+            tqdm.write(f"[!] --max-runtime budget reached: deferred {len(deferred_urls)} retries to the next run.")
         tqdm.write(f"[!] Wrote new error log: {new_error_log}")
     else:
         tqdm.write("[✓] All previously errored posts processed successfully!")
@@ -655,16 +2835,17 @@ def cleanup_and_retry_empty_dirs():
         tqdm.write(f"[!] Session directory not found: {session_dir}")
         return
     
-    # Load processed URLs
+    # Load processed URLs (the index is keyed by shortcode/media ID, so no URL lookup table is needed)
     processed_urls = load_processed_urls(PROCESSED_URLS_FILE)
-    # Map shortcode to URL for quick lookup
-    shortcode_to_url = {url.rstrip('/').split('/')[-1]: url for url in processed_urls}
     
-    empty_shortcodes = []
+    empty_posts = []
     for entry in os.listdir(session_dir):
         entry_path = os.path.join(session_dir, entry)
         if not os.path.isdir(entry_path):
             continue
+        # Posts linked from another session (--global-index) are owned by that session
+        if os.path.islink(entry_path) or os.path.exists(os.path.join(entry_path, LINKED_POST_FILE)):
+            continue
         # Only consider directories with a valid shortcode (date_shortcode)
         if '_' not in entry:
             continue
@@ -677,6 +2858,13 @@ def cleanup_and_retry_empty_dirs():
                 break
         if not has_media:
             tqdm.write(f"[!] Deleting empty post dir: {entry_path}")
+            # Recover the original post URL from metadata.json before it is deleted
+            url = f"{BASE_URL}/p/{shortcode}/"
+            try:
+                with open(os.path.join(entry_path, "metadata.json")) as meta_file:
+                    url = json.load(meta_file).get("url") or url
+            except Exception:
+                pass
             # Remove directory and contents
             try:
                 for root, dirs, files in os.walk(entry_path, topdown=False):
@@ -687,14 +2875,15 @@ def cleanup_and_retry_empty_dirs():
                 os.rmdir(entry_path)
             except Exception as e:
                 tqdm.write(f"[!] Error deleting {entry_path}: {e}")
-            empty_shortcodes.append(shortcode)
+            # The cached extraction produced this empty directory, so load the page again
+            extract_cache_drop(url)
+            empty_posts.append((shortcode, url))
     
     # Remove URLs from processed_urls
     removed_urls = set()
-    for shortcode in empty_shortcodes:
-        url = shortcode_to_url.get(shortcode)
-        if url and url in processed_urls:
-            processed_urls.remove(url)
+    for shortcode, url in empty_posts:
+        if shortcode in processed_urls:
+            processed_urls.remove(shortcode)
             removed_urls.add(url)
     if removed_urls:
         tqdm.write(f"[!] Removed {len(removed_urls)} URLs from processed log.")
@@ -707,7 +2896,7 @@ def cleanup_and_retry_empty_dirs():
         tqdm.write(f"[!] Retrying {len(removed_urls)} cleaned-up posts...")
         for url in tqdm(removed_urls, desc="Retrying Cleaned Posts"):
             try:
-                items, dir_path, call_ytdlp = extract_media_urls(url)
+                items, dir_path, call_ytdlp = extract_post(url)
                 download_images(items, dir_path)
                 if call_ytdlp:
                     shortcode = url.rstrip('/').split('/')[-1]
@@ -719,6 +2908,183 @@ def cleanup_and_retry_empty_dirs():
     else:
         tqdm.write("[✓] No posts to retry after cleanup.")
 
+# === Archive integrity verification ===
+VERIFY_CACHE_FILE = os.path.join(DOWNLOAD_ROOT, ".verify-cache.json")
+MEDIA_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.heic', '.mp4', '.m4v', '.mov', '.webm', '.mkv')
+
+def check_jpeg(f, size):
+    """A JPEG must end with the EOI marker (trailing zero padding is tolerated)."""
+    f.seek(max(0, size - 64))
+    if not f.read().rstrip(b"\x00").endswith(b"\xff\xd9"):
+        return "missing JPEG end marker (truncated)"
+    return None
+
+def check_png(f, size):
+    """A PNG must end with the IEND chunk."""
+    f.seek(max(0, size - 12))
+    if f.read() != b"\x00\x00\x00\x00IEND\xaeB`\x82":
+        return "missing PNG IEND chunk (truncated)"
+    return None
+
+def check_riff(f, size):
+    """A WebP (RIFF) container must be as long as its header says."""
+    f.seek(4)
+    declared = struct.unpack("<I", f.read(4))[0] + 8
+    if declared > size:
+        return f"RIFF container truncated ({size} of {declared} bytes)"
+    return None
+
+def check_iso_bmff(f, size):
+    """Walks the top-level MP4/HEIC boxes; they must tile the file exactly and include the movie/metadata box."""
+    offset = 0
+    box_types = set()
+    while offset < size:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            return f"truncated box header at offset {offset}"
+        box_size, box_type = struct.unpack(">I4s", header)
+        if box_size == 1:
+            large = f.read(8)
+            if len(large) < 8:
+                return f"truncated box header at offset {offset}"
+            box_size = struct.unpack(">Q", large)[0]
+        elif box_size == 0:
+            box_size = size - offset
+        if box_size < 8:
+            return f"invalid box size {box_size} at offset {offset}"
+        box_types.add(box_type)
+        offset += box_size
+    if offset != size:
+        return f"last box runs past end of file ({size} of {offset} bytes)"
+    if b"moov" not in box_types and b"moof" not in box_types and b"meta" not in box_types:
+        return "no moov/moof/meta box"
+    return None
+
+def check_matroska(f, size):
+    """WebM/MKV files are only checked for the EBML header and a non-trivial size."""
+    if size < 1024:
+        return "Matroska file too small"
+    return None
+
+def verify_media_file(path, size):
+    """Validates a media container by its magic bytes. Returns None if it looks intact, else a reason."""
+    if size == 0:
+        return "empty file"
+    try:
+        with open(path, "rb") as f:
+            magic = f.read(12)
+            if magic.startswith(b"\xff\xd8\xff"):
+                return check_jpeg(f, size)
+            if magic.startswith(b"\x89PNG\r\n\x1a\n"):
+                return check_png(f, size)
+            if magic.startswith(b"RIFF") and magic[8:12] == b"WEBP":
+                return check_riff(f, size)
+            if magic[4:8] == b"ftyp":
+                return check_iso_bmff(f, size)
+            if magic.startswith(b"\x1a\x45\xdf\xa3"):
+                return check_matroska(f, size)
+            return "unrecognized file header"
+    except OSError as e:
+        return f"unreadable: {e}"
+
+def scan_media_files(top):
+    """Recursively lists (path, size, mtime_ns) for media files under top using os.scandir (symlinks are not followed)."""
+    found = []
+    stack = [top]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    if entry.name.startswith("."):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False) and entry.name.lower().endswith(MEDIA_EXTENSIONS):
+                        st = entry.stat(follow_symlinks=False)
+                        found.append((entry.path, st.st_size, st.st_mtime_ns))
+        except OSError as e:
+            tqdm.write(f"[!] Could not scan {current}: {e}")
+    return found
+
+def load_verify_cache():
+    if os.path.exists(VERIFY_CACHE_FILE):
+        try:
+            with open(VERIFY_CACHE_FILE, "r") as f:
+                return json.load(f)
+        except json.JSONDecodeError:
+            print(f"[*] Warning: Could not decode {VERIFY_CACHE_FILE}. Re-verifying everything.")
+    return {}
+
+def save_verify_cache(cache):
+    tmp_path = VERIFY_CACHE_FILE + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, VERIFY_CACHE_FILE)
+
+def verify_archive():
+    """
+    Walks DOWNLOAD_ROOT in parallel, validates every image/video container and
+    caches results by (size, mtime) so reruns only check changed files.
+    Corrupt post media is renamed to <file>.corrupt and the post URL is appended
+    to an error log in its session directory, so the normal retry flow re-downloads it.
+    Returns the number of corrupt files found.
+    """
+    tqdm.write(f"[+] Verifying media under {DOWNLOAD_ROOT} with {args.verify_workers} workers")
+    with os.scandir(DOWNLOAD_ROOT) as entries:
+        tops = [e.path for e in entries if e.is_dir(follow_symlinks=False) and not e.name.startswith(".")]
+    with ThreadPoolExecutor(max_workers=args.verify_workers) as pool:
+        files = [item for found in pool.map(scan_media_files, tops) for item in found]
+
+        cache = load_verify_cache()
+        new_cache = {}
+        to_check = []
+        for path, size, mtime_ns in files:
+            rel_path = os.path.relpath(path, DOWNLOAD_ROOT)
+            cached = cache.get(rel_path)
+            if cached and cached[0] == size and cached[1] == mtime_ns:
+                new_cache[rel_path] = cached
+            else:
+                to_check.append((path, rel_path, size, mtime_ns))
+        tqdm.write(f"[i] {len(files)} media files, {len(files) - len(to_check)} unchanged since last verify, checking {len(to_check)}")
+        results = pool.map(lambda item: verify_media_file(item[0], item[2]), to_check)
+        for (path, rel_path, size, mtime_ns), reason in zip(tqdm(to_check, desc="Verifying Media", leave=False), results):
+            new_cache[rel_path] = [size, mtime_ns, reason]
+
+    corrupt = {rel_path: entry[2] for rel_path, entry in new_cache.items() if entry[2]}
+    for rel_path, reason in sorted(corrupt.items()):
+        path = os.path.join(DOWNLOAD_ROOT, rel_path)
+        post_dir = os.path.dirname(path)
+        session = rel_path.split(os.sep)[0]
+        metadata_path = os.path.join(post_dir, "metadata.json")
+        if not os.path.exists(metadata_path):
+            # Stories and other loose files cannot be re-fetched by URL, just report them
+            tqdm.write(f"[!] Corrupt file (not a post, not retried): {path} ({reason})")
+            continue
+        try:
+            with open(metadata_path) as meta_file:
+                post_url = json.load(meta_file)["url"]
+        except Exception as e:
+            tqdm.write(f"[!] Corrupt file {path} ({reason}), but could not read its post URL: {e}")
+            continue
+        tqdm.write(f"[!] Corrupt: {path} ({reason}) → queued {post_url} for retry")
+        try:
+            os.replace(path, path + ".corrupt")
+            del new_cache[rel_path]
+        except OSError as e:
+            tqdm.write(f"[!] Could not move aside {path}: {e}")
+        error_log = os.path.join(DOWNLOAD_ROOT, session, f"{session}-errors_verify_{timestamp_now}{WORKER_TAG}.log")
+        with open(error_log, "a") as elog:
+            elog.write(f"{post_url} — verify: corrupt {os.path.basename(path)} ({reason})\n")
+
+    save_verify_cache(new_cache)
+    if corrupt:
+        tqdm.write(f"[!] Verify found {len(corrupt)} corrupt media files.")
+    else:
+        tqdm.write("[✓] All media files verified OK.")
+    return len(corrupt)
+
 def pause_story_if_playing():
     """Pause the story if it is currently playing (auto-advancing)."""
     try:
@@ -829,7 +3195,7 @@ def download_stories(username):
                             return {width: rect.width, height: rect.height, top: rect.top, left: rect.left};
                         """, img)
                         if box["width"] > 300 and box["height"] > 300 and box["top"] >= 0 and box["left"] >= 0:
-                            media_url = img.get_attribute("src")
+                            media_url = pick_image_url(img.get_attribute("src"), img.get_attribute("srcset"))
                             media_type = "image"
                             break
                     except Exception:
@@ -885,11 +3251,12 @@ def download_stories(username):
                 filepath = os.path.join(story_dir, filename)
                 tqdm.write(f"[↓] Downloading story {slide_idx} ({media_type}): {media_url}")
                 try:
-                    with requests.get(media_url, stream=True, timeout=20) as r:
-                        r.raise_for_status()
-                        with open(filepath, 'wb') as f:
-                            for chunk in r.iter_content(chunk_size=8192):
-                                f.write(chunk)
+                    num_bytes = fetch_to_file(media_url, filepath)
+                    if media_type == "image":
+                        record_image_bytes(media_url, num_bytes)
+                    else:
+                        MEDIA_STATS["videos"] += 1
+                        MEDIA_STATS["video_bytes"] += num_bytes
                 except Exception as e:
                     tqdm.write(f"[!] Failed to download story media: {e}")
                 # Save metadata
@@ -903,6 +3270,7 @@ def download_stories(username):
                 }
                 with open(os.path.join(story_dir, f"story_{timestamp_prefix}_{slide_idx:02d}.json"), "w") as meta_file:
                     json.dump(metadata, meta_file, indent=2)
+                catalog_add_story(story_dir, metadata)
                 downloaded_count += 1
             # Try to go to next story slide (right arrow or auto-advance)
             try: